@@ -1,15 +1,39 @@
 import sys
-from tools.tree import *
-from tools.latex import *
-from tools.matrix import *
+import argparse
+from tools.menu import ask_selection
+
+
+def main(pipeline=False, tex_path=None, exact=False):
+    """
+    Main function to run binary tree exploration and generate LaTeX output.
+
+    Args:
+        pipeline: Build the functional, LaTeX and cancellation checks of symbolic systems
+            concurrently with the exploration (see run_pipeline)
+        tex_path: Stream the LaTeX of the functional to this standalone .tex document
+            (see LatexWriter) instead of printing it
+        exact: For systems without parameters, re-check the numeric rank decisions
+            exactly and build the exact functional and its LaTeX. Otherwise the functional
+            of these systems stays in float64 (see numeric_terms).
+    """
+    output_file_name = "output.txt"
 
+    # The menu needs no SymPy: show it first, and load the pipeline only once a choice is made
+    selection = ask_selection()
+    if selection is None:
+        print("Matrix acquisition failed or was cancelled. Exiting.")
+        return
 
-def main():
-    """Main function to run binary tree exploration and generate LaTeX output."""
-    output_file_name = "output.txt"
+    from sympy import Matrix, symbols
+    from tools.matrix import get_matrices, print_matrix
+    from tools.tree import explore_tree, print_custom_tree, iter_lyapunov_terms, iter_term_pairs, print_lyapunov_terms
+    from tools.latex import functional_to_latex, solve_mixing_coefficients, print_cancellation_summary, LatexWriter
+    from tools.numeric import (is_parameter_free, to_float, explore_tree_numeric, exact_tree,
+                               numeric_mixing_coefficients, numeric_terms, print_numeric_terms)
+    from tools.locus import rank_drop_locus, print_rank_drop_locus
 
     # Get matrices - user input happens here before redirection
-    A, Ba, Bs, size = get_matrices()
+    A, Ba, Bs, size = get_matrices(selection)
 
     if A is None:
         print("Matrix acquisition failed or was cancelled. Exiting.")
@@ -28,12 +52,38 @@ def main():
             print_matrix(Bs, "Matrix Bs (Symmetric Part)")
             print_matrix(Ba, "Matrix Ba (Antisymmetric Part)")
 
-            # Explore the binary tree
-            root, final_rank = explore_tree(A, Ba, Bs, size)
+            # Systems without parameters are explored in float64, and their functional stays
+            # in float64 unless the exact one is asked for
+            numeric = is_parameter_free(A, Ba, Bs) and not exact
+
+            # The LaTeX terms are spooled per level while they are produced, and written at the end
+            writer = LatexWriter(tex_path) if tex_path is not None and not numeric else None
+
+            # Explore the binary tree (in floating point if there are no parameters)
+            results = None
+            if is_parameter_free(A, Ba, Bs):
+                numeric_root, final_rank, conditioning = explore_tree_numeric(
+                    to_float(A), to_float(Ba), to_float(Bs), size)
+                print(f"Conditioning margin: smallest kept singular value {conditioning['smallest_kept']:.3g}, "
+                      f"largest dropped {conditioning['largest_dropped']:.3g} (rtol {conditioning['rtol']:g})")
+
+                if numeric:
+                    root = numeric_root
+                else:
+                    # Exact node matrices for the functional, re-checking the numeric decisions
+                    root, mismatches = exact_tree(numeric_root, A, Ba, Bs, recheck=True)
+                    if mismatches:
+                        print(f"Warning: exact rank decisions differ from the numeric ones at {mismatches}")
+            elif pipeline:
+                from tools.pipeline import run_pipeline
+                results = run_pipeline(A, Ba, Bs, size, writer=writer)
+                root, final_rank = results['root'], results['final_rank']
+            else:
+                root, final_rank = explore_tree(A, Ba, Bs, size)
 
             # Print results
             print(f"\n{'=' * 60}")
-            print(f"FINAL TREE STRUCTURE")
+            print("FINAL TREE STRUCTURE")
             print(f"{'=' * 60}")
             print_custom_tree(root)
 
@@ -41,24 +91,66 @@ def main():
             print(f"Target rank: {size}")
             print(f"Exploration {'completed successfully' if final_rank >= size else 'incomplete'}")
 
+            # Parameter values where the generic rank decisions may not hold
+            if not is_parameter_free(A, Ba, Bs):
+                print_rank_drop_locus(rank_drop_locus(root, A, Ba, Bs))
+
             # Build Lyapunov functional
             print(f"\n{'=' * 60}")
-            print(f"BUILDING LYAPUNOV FUNCTIONAL")
+            print("BUILDING LYAPUNOV FUNCTIONAL")
             print(f"{'=' * 60}")
 
             u_symbols = symbols(' '.join([f'u_{i + 1}' for i in range(size)]))
             U = Matrix(u_symbols)
-            m = symbols('m', real=True)
 
-            functional = build_lyapunov(root, U, A, Ba, size, m)
+            if numeric:
+                A_float, Ba_float = to_float(A), to_float(Ba)
+                m_values = numeric_mixing_coefficients(root, A_float, Ba_float)
+            elif results is not None:
+                # Already built by the pipeline
+                m_values = results['m_values']
+            else:
+                # The m of all the direction-0 nodes, shared by the functional and the LaTeX
+                m_values = solve_mixing_coefficients(root, A, Ba)
+            for node, m_value in m_values.items():
+                print(f"m at {node.name}: {m_value if m_value is not None else 'no constant solution'}")
+
+            if numeric:
+                # Float64 coefficient matrices of the terms, without SymPy
+                for _ in print_numeric_terms(numeric_terms(root, A_float, Ba_float, m_values)):
+                    pass
+                latex_output = "The float64 functional has no LaTeX: run with --exact for the exact functional"
+            elif results is not None:
+                for _ in print_lyapunov_terms(results['terms']):
+                    pass
+                print_cancellation_summary(results['cancellations'])
+                latex_output = results['latex']
+            else:
+                # Stream the functional terms once: each term is printed and turned into
+                # LaTeX as it is produced, without summing the whole functional
+                terms = print_lyapunov_terms(iter_lyapunov_terms(root, U, A, Ba, m_values))
+                latex_output = functional_to_latex(A, Ba, U, root, terms=terms, m_values=m_values, writer=writer)
+
+            # Weights ε_l of the levels, checked numerically on sampled parameters and frequencies
+            print(f"\n{'=' * 60}")
+            print("ε WEIGHTS")
+            print(f"{'=' * 60}")
+            if numeric:
+                print("ε weights: not certified, the check needs the exact functional (run with --exact)")
+            else:
+                from tools.epsilon import certify_epsilon_weights, print_epsilon_certificate
+                print_epsilon_certificate(certify_epsilon_weights(iter_term_pairs(root, A, Ba, m_values), A, Ba + Bs))
 
             # Output LaTeX
             print(f"\n{'=' * 60}")
-            print(f"LATEX OUTPUT")
+            print("LATEX OUTPUT")
             print(f"{'=' * 60}")
 
-            latex_output = functional_to_latex(A, Ba, U, root)
-            print(latex_output)
+            if writer is not None:
+                writer.close()
+                print(f"LaTeX document written to '{tex_path}' ({writer.terms} terms in {writer.blocks} align* blocks)")
+            else:
+                print(latex_output)
 
     finally:
         # Restore console output
@@ -67,5 +159,39 @@ def main():
     print(f"\nAll program output has been saved to '{output_file_name}'")
 
 
+def parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Build Lyapunov functionals for hyperbolic systems.")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="build the functional concurrently with the exploration, in worker processes")
+    parser.add_argument('--exact', action='store_true',
+                        help="for systems without parameters, re-check the tree exactly and build the exact functional")
+    parser.add_argument('--tex', metavar='PATH',
+                        help="write the LaTeX of the functional to a standalone .tex document instead of printing it")
+    parser.add_argument('--serve', action='store_true',
+                        help="run a local analysis server instead of the interactive menu")
+    parser.add_argument('--host', default='127.0.0.1', help="server host (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="server port (default: 8765)")
+    parser.add_argument('--workers', type=int, default=2, help="number of worker processes (default: 2)")
+    parser.add_argument('--queue-size', type=int, default=64, help="maximum number of pending jobs (default: 64)")
+    parser.add_argument('--db', help="SQLite database where the server or the worker stores every result")
+    parser.add_argument('--worker', metavar='QUEUE',
+                        help="drain the work queue in this folder (see tools/worker.py) instead of the interactive menu")
+    parser.add_argument('--lease-seconds', type=float, default=600,
+                        help="time after which the job of a silent worker is retried (default: 600)")
+    parser.add_argument('--max-attempts', type=int, default=3, help="tries of a job before it fails (default: 3)")
+    parser.add_argument('--exit-when-empty', action='store_true', help="stop the worker once the queue is drained")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.serve:
+        from tools.server import serve
+        serve(args.host, args.port, args.workers, args.queue_size, args.db)
+    elif args.worker:
+        from tools.worker import run_worker
+        run_worker(args.worker, db_path=args.db, lease_seconds=args.lease_seconds,
+                   max_attempts=args.max_attempts, exit_when_empty=args.exit_when_empty)
+    else:
+        main(pipeline=args.pipeline, tex_path=args.tex, exact=args.exact)
@@ -0,0 +1,61 @@
+import random
+import pytest
+from sympy import Matrix, Rational, symbols
+from tools.backend import backend_results, product, rank, verification_systems
+
+a, b = symbols('a b', real=True, nonzero=True)
+
+BACKENDS = ['ring', 'flint']
+
+
+def use_backend(name):
+    if name == 'flint':
+        pytest.importorskip('flint')
+    return name
+
+
+def random_rational_matrix(rng, rows, cols, rank_bound=None):
+    """Random rational matrix, of rank at most rank_bound if given (product of two factors)."""
+    def entry():
+        return Rational(rng.randint(-5, 5), rng.randint(1, 4))
+
+    if rank_bound is None:
+        return Matrix(rows, cols, lambda i, j: entry())
+    return Matrix(rows, rank_bound, lambda i, j: entry()) * Matrix(rank_bound, cols, lambda i, j: entry())
+
+
+def random_parametric_matrix(rng, rows, cols, rank_bound=None):
+    """Random matrix of polynomials in a and b, of rank at most rank_bound if given."""
+    monomials = [1, a, b, a * b, a ** 2, b ** 2]
+
+    def entry():
+        return sum(Rational(rng.randint(-3, 3), rng.randint(1, 2)) * m for m in rng.sample(monomials, 2))
+
+    if rank_bound is None:
+        return Matrix(rows, cols, lambda i, j: entry())
+    return (Matrix(rows, rank_bound, lambda i, j: entry()) * Matrix(rank_bound, cols, lambda i, j: entry())).expand()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('system', verification_systems(), ids=lambda system: system[0])
+def test_presets_match_sympy(backend, system):
+    backend = use_backend(backend)
+    name, A, Ba, Bs, size = system
+    reference, _ = backend_results(A, Ba, Bs, size, 'sympy')
+    results, _ = backend_results(A, Ba, Bs, size, backend)
+    assert results == reference
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('make_matrix, max_size', [(random_rational_matrix, 6), (random_parametric_matrix, 3)])
+def test_random_matrices_match_sympy(backend, make_matrix, max_size):
+    backend = use_backend(backend)
+    rng = random.Random(0)
+    for _ in range(20):
+        rows, cols = rng.randint(1, max_size), rng.randint(1, max_size)
+        rank_bound = rng.choice([None, 1, 2])
+        M = make_matrix(rng, rows, cols, rank_bound)
+        assert rank(M, backend) == rank(M, 'sympy')
+
+        N = make_matrix(rng, cols, rng.randint(1, max_size))
+        assert (product(M, N, backend) - product(M, N, 'sympy')).expand() == Matrix.zeros(rows, N.cols)
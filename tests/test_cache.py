@@ -0,0 +1,44 @@
+import os
+from sympy import Matrix, symbols
+from tools import cache
+
+a = symbols('a')
+
+
+def test_saved_caches_load_back(tmp_path):
+    path = str(tmp_path / 'caches.pkl')
+    cache.clear_caches()
+    cache.cached_product(Matrix([[a, 1]]), Matrix([[1], [a]]))
+    cache.cached_rank(Matrix([[a, 1], [1, a]]))
+    assert cache.save_caches(path)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    cache.clear_caches()
+    assert cache.load_caches(path)
+    assert cache.cache_stats()['products'] == 1 and cache.cache_stats()['ranks'] == 1
+
+
+def test_tampered_or_shared_caches_are_not_loaded(tmp_path):
+    path = str(tmp_path / 'caches.pkl')
+    cache.clear_caches()
+    cache.cached_rank(Matrix([[a, 1], [1, a]]))
+    assert cache.save_caches(path)
+    cache.clear_caches()
+
+    with open(path, 'ab') as f:
+        f.write(b'.')
+    assert not cache.load_caches(path)
+
+    assert cache.save_caches(path)
+    os.chmod(path, 0o666)
+    assert not cache.load_caches(path)
+    assert cache.cache_stats()['ranks'] == 0
+
+
+def test_caches_are_bounded(monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_RANKS', 3)
+    cache.clear_caches()
+    for n in range(1, 6):
+        cache.cached_rank(Matrix([[n, a]]))
+    assert cache.cache_stats()['ranks'] == 3
+    cache.clear_caches()
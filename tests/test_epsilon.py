@@ -0,0 +1,27 @@
+import pytest
+from sympy import Matrix
+from tools.analysis import analyze_system
+from tools.matrix import get_preset_matrices
+
+
+def analyze_preset(number):
+    preset = get_preset_matrices(number)
+    A, B = preset['A'], preset['B']
+    return analyze_system(A, (B - B.T) / 2, (B + B.T) / 2, preset['size'])
+
+
+@pytest.mark.parametrize('number, certified', [(1, True), (2, True), (3, False), (4, False)])
+def test_presets_epsilon(number, certified):
+    epsilon = analyze_preset(number)['epsilon']
+    assert epsilon['certified'] == certified
+    if certified:
+        assert epsilon['epsilon'] > 0 and epsilon['dissipation_margin'] > 0 and epsilon['reason'] is None
+    else:
+        assert epsilon['epsilon'] is None and epsilon['reason']
+
+
+def test_parameter_free_system_epsilon():
+    A = Matrix([[0, 2], [2, 0]])
+    B = Matrix([[1, 1], [-1, 0]])
+    epsilon = analyze_system(A, (B - B.T) / 2, (B + B.T) / 2, 2)['epsilon']
+    assert epsilon['certified']
@@ -0,0 +1,33 @@
+import numpy as np
+from sympy import Rational
+from tools.matrix import get_preset_matrices
+from tools.numeric import to_float, explore_tree_numeric, numeric_mixing_coefficients, numeric_terms
+
+
+def numeric_preset(number):
+    """A preset with its parameters set to 2/3, 1, 4/3, ..., as float64 arrays."""
+    preset = get_preset_matrices(number)
+    A, B = preset['A'], preset['B']
+    params = sorted(A.free_symbols | B.free_symbols, key=str)
+    values = {p: Rational(k + 2, 3) for k, p in enumerate(params)}
+    A, B = A.subs(values), B.subs(values)
+    return to_float(A), to_float((B - B.T) / 2), to_float((B + B.T) / 2), A.rows
+
+
+def test_nodes_without_m_keep_it_free():
+    A, Ba, Bs, size = numeric_preset(1)
+    root, _, _ = explore_tree_numeric(A, Ba, Bs, size)
+    m_values = numeric_mixing_coefficients(root, A, Ba)
+    assert m_values
+
+    free = {node: None for node in m_values}
+    mixed = [term for term in numeric_terms(root, A, Ba, free) if term['kind'] == 'mixed']
+    assert mixed
+    for term in mixed:
+        left, right = term['pair']
+        assert term['coefficient'] is None
+        assert np.allclose(term['matrix'], left.T @ right)
+
+    for term in numeric_terms(root, A, Ba, m_values):
+        if term['kind'] == 'mixed':
+            assert term['coefficient'] == m_values[term['node'].parent]
@@ -0,0 +1,36 @@
+import time
+import pytest
+from sympy import Matrix, Rational, symbols
+from tools.server import parse_entry, system_from_payload
+
+a, b = symbols('a b', real=True, nonzero=True)
+
+
+@pytest.mark.parametrize('entry, expected', [
+    (3, 3),
+    ("a^2 - 1/2", a ** 2 - Rational(1, 2)),
+    ("-(a+b)**2/3", -(a + b) ** 2 / 3),
+    ("a**-2", a ** -2),
+])
+def test_parse_entry(entry, expected):
+    assert parse_entry(entry) == expected
+
+
+@pytest.mark.parametrize('entry', [
+    "__import__('os').system('true')", "(1).__class__", "x", "sin(a)", "1j", "lambda: 1", True, [1],
+    "9**9**9", "(9**9)**9", "a**b", "2**100", "10000000000000", 10 ** 13, "1e300", "a" + "+a" * 200,
+])
+def test_parse_entry_rejects(entry):
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        parse_entry(entry)
+    # Rejected by the checks, not after evaluating the entry
+    assert time.perf_counter() - start < 1
+
+
+def test_system_from_payload():
+    A, Ba, Bs, size = system_from_payload({'A': [["0", "a"], ["a", 0]], 'B': [[1, "b"], [0, 0]]})
+    assert size == 2
+    assert A == Matrix([[0, a], [a, 0]])
+    assert Ba + Bs == Matrix([[1, b], [0, 0]])
+    assert Ba == -Ba.T and Bs == Bs.T
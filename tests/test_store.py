@@ -0,0 +1,26 @@
+from tools.store import ResultStore, store_results
+
+
+def fake_result():
+    tree = {'name': 'root', 'level': 1, 'direction': None, 'number': 0, 'children': []}
+    return {'system': {'A': [['1']], 'B': [['1']], 'parameters': []}, 'size': 1, 'final_rank': 1,
+            'complete': True, 'tree': tree, 'm_values': {}, 'latex': '', 'terms': [], 'cancellations': []}
+
+
+def test_job_stored_once(tmp_path):
+    path = str(tmp_path / 'results.db')
+    first = store_results(path, [fake_result(), fake_result()], job_id='job')
+    second = store_results(path, [fake_result(), fake_result()], job_id='job')
+    assert first == second
+    store_results(path, [fake_result()])
+    store_results(path, [fake_result()])
+    with ResultStore(path) as store:
+        assert store.count() == 4
+
+
+def test_locus_is_stored(tmp_path):
+    path = str(tmp_path / 'results.db')
+    result = dict(fake_result(), locus=['a - b', 'a + 2'])
+    run_id, = store_results(path, [result])
+    with ResultStore(path) as store:
+        assert store.locus(run_id) == ['a - b', 'a + 2']
@@ -0,0 +1,23 @@
+import os
+import time
+from tools.worker import WorkQueue
+
+
+def test_lost_lease_is_not_completed(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease_seconds=1)
+    queue.submit([{'preset': 1}])
+    job = queue.claim('first')
+
+    # The first worker stalls: its lease expires and a second worker takes the job
+    leased = queue.job_path('leased', job['id'])
+    os.utime(leased, (time.time() - 10, time.time() - 10))
+    assert queue.requeue_expired() == 1
+    second = queue.claim('second')
+    assert second['id'] == job['id']
+
+    assert not queue.heartbeat(job['id'], 'first')
+    assert not queue.complete(job, {'final_rank': 1})
+    assert os.path.exists(leased)
+    assert queue.heartbeat(job['id'], 'second')
+    assert queue.complete(second, {'final_rank': 1})
+    assert queue.status() == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0}
@@ -0,0 +1,102 @@
+import io
+import time
+from contextlib import redirect_stdout
+from sympy import Matrix, symbols
+from tools.tree import explore_tree, iter_lyapunov_terms, iter_term_pairs, term_to_dict, tree_to_dict
+from tools.latex import functional_to_latex, solve_mixing_coefficients
+from tools.numeric import free_parameters, is_parameter_free, to_float, explore_tree_numeric, exact_tree
+from tools.locus import rank_drop_locus
+
+
+def matrix_to_rows(matrix):
+    """Rows of a matrix with the entries as strings (the format of the server payloads)."""
+    return [[str(entry) for entry in matrix.row(i)] for i in range(matrix.rows)]
+
+
+def cancellation_to_dict(summary):
+    """Convert a cancellation summary of functional_to_latex into a JSON-serializable dict."""
+    analysis = summary['analysis_result']
+    cancellation = analysis['cancellation_analysis'] or {}
+    return {
+        'node': summary['node'],
+        'm_value': None if analysis['m_value'] is None else str(analysis['m_value']),
+        'status': cancellation.get('status', analysis['status']),
+        'expression': str(cancellation.get('expression', '')),
+        'parameters': str(cancellation.get('parameters', '--')),
+        'solutions': [str(solution) for solution in cancellation.get('solutions', [])]
+    }
+
+
+def analyze_system(A, Ba, Bs, size):
+    """
+    Run the whole pipeline on a system: tree exploration, functional and LaTeX.
+
+    The printed diagnostics of every stage are captured instead of written to stdout.
+
+    Returns:
+        dict with the JSON-serializable results:
+        - 'size', 'final_rank', 'complete': target rank, rank reached and whether it was reached
+        - 'tree': nested dict of the tree (see tree_to_dict)
+        - 'terms': list of functional terms (see term_to_dict)
+        - 'm_values': the m of the direction-0 nodes, by node name
+        - 'locus': the factors whose zero sets contain the parameter values where the tree
+          may not hold (see rank_drop_locus), empty for a system without parameters
+        - 'latex': LaTeX code of the functional
+        - 'system': A and B as rows of strings, and the parameters
+        - 'cancellations': the cancellation checks of the direction-0 nodes (see cancellation_to_dict)
+        - 'epsilon': the ε weights of the levels, or why they are not certified (see certify_epsilon_weights)
+        - 'timings': seconds spent in the exploration, in the functional and LaTeX, in the ε
+          weights, and in total
+        - 'log': the captured output
+    """
+    # NumPy is only needed from the ε weights on
+    from tools.epsilon import certify_epsilon_weights
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(log):
+        locus = []
+        if is_parameter_free(A, Ba, Bs):
+            numeric_root, final_rank, _ = explore_tree_numeric(to_float(A), to_float(Ba), to_float(Bs), size)
+            root, _ = exact_tree(numeric_root, A, Ba, Bs)
+        else:
+            root, final_rank = explore_tree(A, Ba, Bs, size)
+            locus = rank_drop_locus(root, A, Ba, Bs)['factors']
+        explored = time.perf_counter()
+
+        U = Matrix(symbols(' '.join([f'u_{i + 1}' for i in range(size)])))
+        m_values = solve_mixing_coefficients(root, A, Ba)
+
+        terms = []
+        cancellations = []
+
+        def record(stream):
+            for term in stream:
+                terms.append(term_to_dict(term))
+                yield term
+
+        latex_output = functional_to_latex(A, Ba, U, root,
+                                           terms=record(iter_lyapunov_terms(root, U, A, Ba, m_values)),
+                                           m_values=m_values, cancellations=cancellations)
+        built = time.perf_counter()
+
+        epsilon = certify_epsilon_weights(iter_term_pairs(root, A, Ba, m_values), A, Ba + Bs)
+    finished = time.perf_counter()
+
+    return {
+        'size': size,
+        'final_rank': final_rank,
+        'complete': final_rank is not None and final_rank >= size,
+        'tree': tree_to_dict(root),
+        'terms': terms,
+        'm_values': {node.name: None if m is None else str(m) for node, m in m_values.items()},
+        'locus': [str(factor) for factor in locus],
+        'latex': latex_output,
+        'system': {'A': matrix_to_rows(A), 'B': matrix_to_rows(Ba + Bs),
+                   'parameters': [str(p) for p in free_parameters(A, Ba, Bs)]},
+        'cancellations': [cancellation_to_dict(summary) for summary in cancellations],
+        'epsilon': epsilon,
+        'timings': {'exploration': explored - start, 'functional': built - explored, 'epsilon': finished - built,
+                    'total': finished - start},
+        'log': log.getvalue()
+    }
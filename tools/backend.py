@@ -0,0 +1,298 @@
+"""
+Arithmetic backends of the exact matrix products and ranks.
+
+Every product of the tree exploration and every rank of its decisions goes through
+cached_product and cached_rank, which call product() and rank() below. The backend is:
+- 'sympy': SymPy Matrix arithmetic (always available)
+- 'ring': fraction-free elimination over SymPy's sparse polynomial ring QQ[params]
+- 'flint': python-flint (fmpz_mat / fmpq_mat for numeric matrices, fraction-free
+  elimination over fmpq_mpoly for polynomial ones), if it is installed
+
+It is chosen with $HYPERNONSYM_BACKEND ('auto' by default: 'flint' when installed, else
+'sympy') or set_backend(). Matrices that a backend cannot represent (e.g. entries with
+1/a or sqrt(2)) fall back to SymPy. Products of symbolic matrices always use SymPy, so
+that the node matrices, the functional and the LaTeX keep the same expressions whatever
+the backend.
+
+Usage, from the project folder:
+    python -m tools.backend   (check that all available backends agree on the presets)
+"""
+import os
+from sympy import Matrix, Poly, QQ, Rational
+from sympy.polys.polyerrors import CoercionFailed, GeneratorsNeeded, PolynomialError
+from sympy.polys.rings import ring
+
+BACKENDS = ('sympy', 'ring', 'flint')
+
+_state = {'name': None}
+
+
+def flint_module():
+    """The python-flint module, or None if it is not installed."""
+    try:
+        import flint
+    except ImportError:
+        return None
+    return flint
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != 'flint' or flint_module() is not None]
+
+
+def set_backend(name):
+    """
+    Select the backend ('sympy', 'ring', 'flint' or 'auto').
+
+    Returns:
+        The name of the selected backend
+    """
+    if name == 'auto':
+        name = 'flint' if flint_module() is not None else 'sympy'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)} or 'auto'")
+    if name == 'flint' and flint_module() is None:
+        raise ValueError("The flint backend needs python-flint (pip install python-flint)")
+    _state['name'] = name
+    return name
+
+
+def get_backend():
+    """The selected backend, from $HYPERNONSYM_BACKEND on first use."""
+    if _state['name'] is None:
+        set_backend(os.environ.get('HYPERNONSYM_BACKEND', 'auto'))
+    return _state['name']
+
+
+def is_rational_matrix(M):
+    return all(entry.is_Rational for entry in M)
+
+
+def polynomial_entries(M):
+    """
+    Entries of M as dicts {monomial: coefficient} over QQ in its free symbols.
+
+    Returns:
+        (params, list of dicts in row-major order), or None if an entry is not a polynomial
+        with rational coefficients
+    """
+    params = sorted(M.free_symbols, key=str)
+    if not params:
+        return None
+    try:
+        return params, [Poly(entry, *params, domain=QQ).as_dict() for entry in M]
+    except (CoercionFailed, GeneratorsNeeded, PolynomialError):
+        return None
+
+
+def fraction_free_rank(rows, divide):
+    """
+    Rank of a matrix over an integral domain, by Bareiss fraction-free elimination.
+
+    Every entry after step k is a (k+1)-minor of the matrix, divided exactly by the
+    previous pivot, so the entries never become fractions and their size stays bounded.
+
+    Args:
+        rows: List of rows of domain elements (supporting +, -, * and truth value)
+        divide: Exact division of two domain elements
+    """
+    rows = [list(row) for row in rows]
+    cols = len(rows[0]) if rows else 0
+    rank = 0
+    previous = None
+    for column in range(cols):
+        pivot_row = next((i for i in range(rank, len(rows)) if rows[i][column]), None)
+        if pivot_row is None:
+            continue
+        rows[rank], rows[pivot_row] = rows[pivot_row], rows[rank]
+        pivot_entries = rows[rank]
+        pivot = pivot_entries[column]
+        for row in rows[rank + 1:]:
+            entry = row[column]
+            # The entries up to this column are not read again
+            for j in range(column + 1, cols):
+                value = pivot * row[j] - entry * pivot_entries[j]
+                row[j] = value if previous is None else divide(value, previous)
+        previous = pivot
+        rank += 1
+        if rank == len(rows):
+            break
+    return rank
+
+
+def ring_rank(M):
+    """Rank of a polynomial matrix by fraction-free elimination over SymPy's ring QQ[params]."""
+    entries = polynomial_entries(M)
+    if entries is None:
+        return None
+    params, dicts = entries
+    R = ring(params, QQ)[0]
+    values = [R.from_dict(entry) for entry in dicts]
+    rows = [values[i * M.cols:(i + 1) * M.cols] for i in range(M.rows)]
+    return fraction_free_rank(rows, lambda a, b: a.exquo(b))
+
+
+def flint_context(flint, params):
+    """Context of the fmpq_mpoly in the given symbols (python-flint >= 0.7)."""
+    names = tuple(str(p) for p in params)
+    context_type = flint.fmpq_mpoly_ctx
+    if hasattr(context_type, 'get'):
+        return context_type.get(names, 'lex')
+    return context_type.get_context(len(names), flint.Ordering.lex, names=names)
+
+
+def flint_fmpq(flint, value):
+    return flint.fmpq(int(value.p), int(value.q))
+
+
+def from_flint_fmpq(value):
+    return Rational(int(value.p), int(value.q))
+
+
+def flint_rank(M):
+    flint = flint_module()
+    if is_rational_matrix(M):
+        if all(entry.is_Integer for entry in M):
+            return flint.fmpz_mat(M.rows, M.cols, [int(entry) for entry in M]).rank()
+        return flint.fmpq_mat(M.rows, M.cols, [flint_fmpq(flint, entry) for entry in M]).rank()
+
+    entries = polynomial_entries(M)
+    if entries is None:
+        return None
+    params, dicts = entries
+    context = flint_context(flint, params)
+    values = [context.from_dict({monomial: flint_fmpq(flint, coefficient)
+                                 for monomial, coefficient in entry.items()})
+              for entry in dicts]
+    rows = [values[i * M.cols:(i + 1) * M.cols] for i in range(M.rows)]
+    return fraction_free_rank(rows, lambda a, b: a / b)
+
+
+def flint_product(X, Y):
+    flint = flint_module()
+    if all(entry.is_Integer for entry in X) and all(entry.is_Integer for entry in Y):
+        product = (flint.fmpz_mat(X.rows, X.cols, [int(entry) for entry in X])
+                   * flint.fmpz_mat(Y.rows, Y.cols, [int(entry) for entry in Y]))
+        return Matrix(X.rows, Y.cols, [int(entry) for entry in product.entries()])
+    product = (flint.fmpq_mat(X.rows, X.cols, [flint_fmpq(flint, entry) for entry in X])
+               * flint.fmpq_mat(Y.rows, Y.cols, [flint_fmpq(flint, entry) for entry in Y]))
+    return Matrix(X.rows, Y.cols, [from_flint_fmpq(entry) for entry in product.entries()])
+
+
+def rank(M, backend=None):
+    """Rank of a SymPy matrix with the selected backend (or the given one)."""
+    if backend is None:
+        backend = get_backend()
+    if M.rows == 0 or M.cols == 0:
+        return 0
+    result = None
+    if backend == 'ring':
+        result = M.rank() if is_rational_matrix(M) else ring_rank(M)
+    elif backend == 'flint':
+        result = flint_rank(M)
+    return M.rank() if result is None else result
+
+
+def product(X, Y, backend=None):
+    """Product X*Y of SymPy matrices with the selected backend (or the given one)."""
+    if backend is None:
+        backend = get_backend()
+    if backend == 'flint' and is_rational_matrix(X) and is_rational_matrix(Y):
+        return flint_product(X, Y)
+    return X * Y
+
+
+def backend_results(A, Ba, Bs, size, backend):
+    """
+    Run the exploration and the functional with one backend, from empty caches.
+
+    Returns:
+        (results, seconds): the tree, final rank, ranks of the node matrices and LaTeX
+    """
+    import io
+    import time
+    from contextlib import redirect_stdout
+    from sympy import symbols
+    from tools.cache import clear_caches
+    from tools.tree import explore_tree, iter_nodes, tree_to_dict
+    from tools.latex import functional_to_latex, solve_mixing_coefficients
+
+    previous = get_backend()
+    set_backend(backend)
+    clear_caches()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            root, final_rank = explore_tree(A, Ba, Bs, size)
+            U = Matrix(symbols(' '.join(f'u_{i + 1}' for i in range(size)), seq=True))
+            m_values = solve_mixing_coefficients(root, A, Ba)
+            latex_output = functional_to_latex(A, Ba, U, root, m_values=m_values)
+        node_ranks = {node.name: rank(node.matrix) for node in iter_nodes(root)}
+    finally:
+        set_backend(previous)
+        clear_caches()
+    results = {
+        'tree': tree_to_dict(root),
+        'final_rank': final_rank,
+        'node_ranks': node_ranks,
+        'latex': latex_output
+    }
+    return results, time.perf_counter() - start
+
+
+def verification_systems():
+    """The presets, symbolic and with integer parameter values (name, A, Ba, Bs, size)."""
+    from tools.matrix import get_preset_matrices
+    from tools.menu import PRESET_NAMES
+
+    systems = []
+    for preset in PRESET_NAMES:
+        data = get_preset_matrices(preset)
+        A, B = data['A'], data['B']
+        params = sorted(A.free_symbols | B.free_symbols, key=str)
+        values = {p: k + 2 for k, p in enumerate(params)}
+        for name, (A_system, B_system) in ((f"preset {preset}", (A, B)),
+                                           (f"preset {preset} at {values}", (A.subs(values), B.subs(values)))):
+            Bs = (B_system + B_system.T) / 2
+            Ba = (B_system - B_system.T) / 2
+            systems.append((name, A_system, Ba, Bs, data['size']))
+    return systems
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check that the arithmetic backends give identical results.")
+    parser.add_argument('--backends', nargs='+', default=None,
+                        help=f"backends to compare (default: the available ones among {', '.join(BACKENDS)})")
+    args = parser.parse_args()
+
+    backends = args.backends or available_backends()
+    if flint_module() is None:
+        print("python-flint is not installed: the flint backend is skipped")
+
+    failures = []
+    for name, A, Ba, Bs, size in verification_systems():
+        reference = None
+        timings = []
+        for backend in backends:
+            results, seconds = backend_results(A, Ba, Bs, size, backend)
+            timings.append(f"{backend} {seconds:.2f} s")
+            if reference is None:
+                reference = results
+                continue
+            differing = [key for key in results if results[key] != reference[key]]
+            if differing:
+                failures.append(f"{name}: {backend} differs from {backends[0]} in {', '.join(differing)}")
+        print(f"{name:40s} {', '.join(timings)}")
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        raise SystemExit(1)
+    print(f"\nAll backends agree ({', '.join(backends)})")
+
+
+if __name__ == "__main__":
+    main()
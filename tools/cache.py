@@ -0,0 +1,144 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from sympy import ImmutableMatrix
+from tools.backend import product as backend_product, rank as backend_rank
+
+# Bounds of the caches: a long-lived process (--serve, --worker) runs many unrelated
+# systems, so the least recently used entries are dropped beyond these sizes
+MAX_PRODUCTS = 10000
+MAX_RANKS = 100000
+
+# Process-wide caches, shared by every run in the same interpreter, least recently used first
+_products = OrderedDict()
+_ranks = OrderedDict()
+_stats = {'product_hits': 0, 'product_misses': 0, 'rank_hits': 0, 'rank_misses': 0}
+
+
+def remember(cache, key, value, limit):
+    """Put an entry in a cache, dropping the least recently used entries beyond limit."""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def product_key(X, Y):
+    """Key of the product X*Y: the two factors as immutable matrices."""
+    return ImmutableMatrix(X), ImmutableMatrix(Y)
+
+
+def rank_key(M):
+    """
+    Canonical key for the rank of M.
+
+    The rank does not depend on the order of the rows, on repeated rows or on zero
+    rows, so M is reduced to the set of its distinct nonzero rows. Stacks built in a
+    different order, or with extra zero rows, share the same key.
+    """
+    rows = frozenset(tuple(M.row(i)) for i in range(M.rows) if any(entry != 0 for entry in M.row(i)))
+    return M.cols, rows
+
+
+def cached_product(X, Y):
+    """Return X*Y, reusing the result of any previous run with the same factors."""
+    key = product_key(X, Y)
+    product = _products.get(key)
+    if product is None:
+        _stats['product_misses'] += 1
+        product = backend_product(X, Y)
+        remember(_products, key, ImmutableMatrix(product), MAX_PRODUCTS)
+    else:
+        _stats['product_hits'] += 1
+        _products.move_to_end(key)
+    return product.as_mutable()
+
+
+def store_product(X, Y, product):
+    """Put a product X*Y computed elsewhere (e.g. updated incrementally) in the cache."""
+    remember(_products, product_key(X, Y), ImmutableMatrix(product), MAX_PRODUCTS)
+
+
+def cached_rank(M):
+    """Return the rank of M, reusing the result of any previous run with the same rows."""
+    key = rank_key(M)
+    rank = _ranks.get(key)
+    if rank is None:
+        _stats['rank_misses'] += 1
+        rank = backend_rank(M)
+        remember(_ranks, key, rank, MAX_RANKS)
+    else:
+        _stats['rank_hits'] += 1
+        _ranks.move_to_end(key)
+    return rank
+
+
+def cache_stats():
+    """Return the number of cached entries and the hits/misses so far."""
+    return dict(_stats, products=len(_products), ranks=len(_ranks))
+
+
+def clear_caches():
+    """Empty the product and rank caches."""
+    _products.clear()
+    _ranks.clear()
+    for key in _stats:
+        _stats[key] = 0
+
+
+def save_caches(path):
+    """
+    Persist the product and rank caches to a file, readable and writable by the current user only.
+
+    Returns:
+        True if the file was written, False if its folder is not private (see is_private)
+    """
+    from tools.kernels import is_private
+
+    folder = os.path.dirname(os.path.abspath(path))
+    if not is_private(folder):
+        # Never write a pickle where others could replace it
+        return False
+    data = pickle.dumps({'products': dict(_products), 'ranks': dict(_ranks)})
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(f"SHA256 {hashlib.sha256(data).hexdigest()}\n".encode('ascii'))
+        f.write(data)
+    os.replace(temporary, path)
+    return True
+
+
+def load_caches(path):
+    """
+    Merge the caches persisted in a file into the current ones.
+
+    Unpickling runs code, so, as for the kernel files, the file and its folder must belong
+    to the current user with nobody else able to write to them, and the data must match
+    the SHA-256 of the first line.
+
+    Returns:
+        True if the file could be read, False otherwise
+    """
+    from tools.kernels import is_private
+
+    if not is_private(os.path.dirname(os.path.abspath(path))) or not is_private(path):
+        return False
+    try:
+        with open(path, 'rb') as f:
+            first_line = f.readline()
+            data = f.read()
+    except OSError:
+        return False
+    if first_line.strip() != f"SHA256 {hashlib.sha256(data).hexdigest()}".encode('ascii'):
+        return False
+    try:
+        data = pickle.loads(data)
+    except (EOFError, pickle.UnpicklingError):
+        return False
+
+    for key, value in data.get('products', {}).items():
+        remember(_products, key, value, MAX_PRODUCTS)
+    for key, value in data.get('ranks', {}).items():
+        remember(_ranks, key, value, MAX_RANKS)
+    return True
@@ -1,5 +1,4 @@
-from sympy import Matrix, symbols, zeros, sympify
-import numpy as np
+from sympy import Matrix, sympify
 import random # For generating random symbols or values if desired
 
 class Create_System:
@@ -71,6 +70,8 @@ class Create_System:
         Generates random symbolic matrices A (symmetric), Ba (antisymmetric),
         and Bs (symmetric) with a user-specified rank for Bs.
         """
+        import numpy as np
+
         # Generate random integer elements for A using NumPy, then convert to SymPy Matrix
         A_np = np.random.randint(-2, 2, size=(self.size, self.size))
         A = Matrix((A_np + A_np.T)) # Ensure A is symmetric from random gen
@@ -0,0 +1,224 @@
+from fractions import Fraction
+import mpmath
+from sympy import I, N, Poly, eye, im, re, symbols
+from sympy.polys.matrices import DomainMatrix
+
+
+def characteristic_polynomial(A, B, lam=None, xi=None):
+    """
+    Characteristic polynomial det(λI + iξA + B) of the system in Fourier variables.
+
+    The determinant is computed once, fraction-free, on the polynomial-domain matrix
+    λI + zA + B with z = iξ (so that the domain stays free of I), then z is replaced by iξ.
+
+    Returns:
+        Poly in (λ, ξ), with the parameters of A and B in the coefficients
+    """
+    if lam is None:
+        lam = symbols('lambda')
+    if xi is None:
+        xi = symbols('xi', real=True)
+    z = symbols('z')
+
+    E = DomainMatrix.from_Matrix(lam * eye(A.rows) + z * A + B)
+    determinant = E.domain.to_sympy(E.det())
+
+    return Poly(determinant.subs(z, I * xi), lam, xi)
+
+
+def _to_mpc(value, dps):
+    """Convert an exact SymPy number into an mpmath complex number."""
+    return mpmath.mpc(mpmath.mpf(str(N(re(value), dps))), mpmath.mpf(str(N(im(value), dps))))
+
+
+def _lower_hull(points):
+    """Lower convex hull of points (j, k), sorted by j."""
+    hull = []
+    for point in sorted(points):
+        while len(hull) >= 2:
+            (j1, k1), (j2, k2) = hull[-2], hull[-1]
+            # Remove the middle point if it lies on or above the segment
+            if (k2 - k1) * (point[0] - j1) >= (point[1] - k1) * (j2 - j1):
+                hull.pop()
+            else:
+                break
+        hull.append(point)
+    return hull
+
+
+def _cluster_roots(roots, tol):
+    """Group numerically repeated roots: list of (root, multiplicity)."""
+    clusters = []
+    for root in roots:
+        for cluster in clusters:
+            if abs(cluster[0] - root) <= tol * max(1, abs(root)):
+                cluster[1] += 1
+                break
+        else:
+            clusters.append([root, 1])
+    return [(root, multiplicity) for root, multiplicity in clusters]
+
+
+def _puiseux_branches(poly, only_positive, max_terms, tol):
+    """
+    Newton-Puiseux expansion of the roots of poly(μ, t) = 0 as t -> 0.
+
+    Args:
+        poly: dict {(j, k): coefficient} for the monomials μ^j t^k (k a Fraction)
+        only_positive: Keep only the roots μ -> 0 (exponents > 0)
+
+    Returns:
+        list of (terms, multiplicity, real_term), where terms is the list of (c, q) of the
+        series μ = Σ c t^q, and real_term the first (c, q) with Re c != 0 (or None)
+    """
+    scale = max(abs(c) for c in poly.values())
+    points = [(j, k) for (j, k), c in poly.items() if abs(c) > tol * scale]
+    if not points:
+        return []
+
+    hull = _lower_hull(points)
+    branches = []
+    for (j1, k1), (j2, k2) in zip(hull, hull[1:]):
+        q = -Fraction(k2 - k1) / (j2 - j1)
+        if only_positive and q <= 0:
+            continue
+
+        # Edge polynomial Σ a_jk c^(j - j1) over the points of the edge
+        edge = {j - j1: poly[(j, k)] for (j, k) in points if k + q * j == k1 + q * j1}
+        degree = j2 - j1
+        coefficients = [edge.get(d, mpmath.mpc(0)) for d in range(degree, -1, -1)]
+        roots = mpmath.polyroots(coefficients, maxsteps=200, extraprec=200) if degree > 1 \
+            else [-coefficients[1] / coefficients[0]]
+
+        for c, multiplicity in _cluster_roots(roots, mpmath.mpf(10) ** (-mpmath.mp.dps // 3)):
+            if abs(mpmath.re(c)) > tol ** 0.5 * abs(c):
+                branches.append(([(c, q)], multiplicity, (c, q)))
+                continue
+            if max_terms <= 1:
+                branches.append(([(c, q)], multiplicity, None))
+                continue
+
+            # Substitute μ = t^q (c + ν) and expand the roots ν -> 0
+            substituted = {}
+            for (j, k), a in poly.items():
+                for i in range(j + 1):
+                    key = (i, k + q * j)
+                    substituted[key] = substituted.get(key, 0) + a * mpmath.binomial(j, i) * c ** (j - i)
+            lowest = min(k for (_, k) in substituted)
+            substituted = {(i, k - lowest): a for (i, k), a in substituted.items()}
+
+            inner = _puiseux_branches(substituted, True, max_terms - 1, tol)
+            if not inner:
+                # ν = 0 is a root: the series stops, the real part vanishes to this order
+                branches.append(([(c, q)], multiplicity, None))
+            for terms, inner_multiplicity, real_term in inner:
+                # The exponents of ν are relative to t^q
+                terms = [(c, q)] + [(ci, q + qi) for ci, qi in terms]
+                if real_term is not None:
+                    real_term = (real_term[0], q + real_term[1])
+                branches.append((terms, min(multiplicity, inner_multiplicity), real_term))
+
+    return branches
+
+
+def decay_exponents(A, B, values=None, regime='high', max_terms=8, dps=60):
+    """
+    Leading behavior of the real parts of the eigenvalues of -(iξA + B).
+
+    The roots λ(ξ) of det(λI + iξA + B) = 0 are expanded as Puiseux series
+    λ = Σ c_k ξ^(e_k) with Newton polygons, as ξ -> ∞ (regime 'high') or ξ -> 0 (regime
+    'low'), until the first term with a nonzero real part. Each root λ is an eigenvalue of
+    -(iξA + B) itself: the branch decays if Re λ < 0, and Re λ ~ Re(c) ξ^e gives its exact
+    decay exponent.
+
+    Args:
+        values: dict {parameter: value} for the parameters of A and B (exact values,
+            e.g. integers or Rationals, are recommended)
+        max_terms: Maximum number of terms of each series
+        dps: Decimal digits of the numerical root finding
+
+    Returns:
+        list of dicts, one per branch, with:
+        - 'multiplicity': number of eigenvalues following the branch
+        - 'leading': (coefficient, exponent) of the first term of λ
+        - 'real_part': (Re coefficient, exponent) of the first term with a real part,
+          None if none was found within max_terms (e.g. an undamped mode)
+    """
+    if regime not in ('high', 'low'):
+        raise ValueError("regime must be 'high' or 'low'")
+
+    lam, xi = symbols('lambda'), symbols('xi', real=True)
+    P = characteristic_polynomial(A, B, lam, xi)
+    if values:
+        P = Poly(P.as_expr().subs(values), lam, xi)
+    free = P.free_symbols - {lam, xi}
+    if free:
+        raise ValueError(f"Values are required for the parameters {sorted(free, key=str)}")
+
+    with mpmath.workdps(dps):
+        sign = -1 if regime == 'high' else 1  # t = 1/ξ at high frequencies, t = ξ at low ones
+        poly = {(j, sign * Fraction(k)): _to_mpc(c, dps + 10) for (j, k), c in P.terms()}
+        tol = mpmath.mpf(10) ** (-dps // 2)
+        branches = _puiseux_branches(poly, False, max_terms, tol)
+
+        results = []
+        for terms, multiplicity, real_term in branches:
+            c0, q0 = terms[0]
+            results.append({
+                'multiplicity': multiplicity,
+                'leading': (complex(c0), sign * q0),
+                'real_part': None if real_term is None else (float(mpmath.re(real_term[0])), sign * real_term[1])
+            })
+    return results
+
+
+def decay_rate_exponent(branches, regime='high'):
+    """
+    Exponent of the slowest decay among the branches: |Re λ| ~ ξ^exponent.
+
+    Returns:
+        The exponent, or None if some branch has no decay within the computed terms
+    """
+    exponents = []
+    for branch in branches:
+        if branch['real_part'] is None:
+            return None
+        exponents.append(branch['real_part'][1])
+    # The slowest decay is the smallest real part: lowest power at ξ -> ∞, highest at ξ -> 0
+    return min(exponents) if regime == 'high' else max(exponents)
+
+
+def predicted_high_frequency_exponent(root, A, Ba):
+    """
+    High-frequency decay exponent predicted by the functional of a tree.
+
+    The term of a node ending in A recovers ξ^2 |X A û|^2 / ξ^xi_exp, the term of a node
+    ending in Ba recovers |X Ba û|^2 / ξ^xi_exp. The slowest of them gives the exponent.
+    """
+    from tools.tree import iter_term_pairs
+
+    exponents = [(2 if term['kind'] == 'A' else 0) - term['xi_exp']
+                 for term in iter_term_pairs(root, A, Ba) if term['kind'] in ('A', 'Ba')]
+    return min(exponents, default=0)
+
+
+def print_decay_exponents(branches, regime='high', predicted=None):
+    """Print the branches, the resulting decay exponent and, if given, the tree prediction."""
+    limit = "ξ -> ∞" if regime == 'high' else "ξ -> 0"
+    print(f"Eigenvalue branches as {limit}:")
+    for branch in branches:
+        c, e = branch['leading']
+        line = f"  x{branch['multiplicity']}: λ ~ ({c.real:.6g} + {c.imag:.6g}i) ξ^{e}"
+        if branch['real_part'] is None:
+            line += ", no real part found"
+        else:
+            c_re, e_re = branch['real_part']
+            line += f", Re λ ~ {c_re:.6g} ξ^{e_re}"
+        print(line)
+
+    exponent = decay_rate_exponent(branches, regime)
+    print(f"Decay exponent: {exponent if exponent is not None else 'undetermined (undamped branch)'}")
+
+    if predicted is not None:
+        verdict = "agrees" if exponent == predicted else "differs"
+        print(f"Tree prediction: {predicted} ({verdict})")
@@ -0,0 +1,240 @@
+import numpy as np
+from tools.numeric import free_parameters, lambdify_matrix, parameter_points, term_coefficient_matrix
+from tools.kernels import compile_kernels
+
+
+def level_fourier_matrices(terms, params, points, xi_grid):
+    """
+    Hermitian matrices of the functional in Fourier variables, grouped by tree level.
+
+    A term coefficient * ⟨left U, right ∂_x^d U⟩ / ξ^e becomes, by Parseval,
+    Re Û^* S (iξ)^d / ξ^e Û with S = coefficient * left^T right. The matrices are
+    evaluated with the compiled kernels of the functional (see compile_kernels).
+
+    Returns:
+        dict {level: array of shape (P, X, n, n)} for P parameter points and X frequencies
+    """
+    return compile_kernels(terms, params=params).by_level('L', xi_grid, points)
+
+
+def compute_epsilon_weights(terms, A, B, params=None, samples=None, xi_grid=None,
+                            lower=0.25, upper=0.75, epsilon_grid=None, hierarchy=(0.5, 1.0, 0.25, 1.5, 2.0),
+                            iterations=20, rtol=1e-12, safety=100):
+    """
+    Compute admissible ε weights for the terms of the functional.
+
+    The term of level l is weighted by ε_l = ε^(1 + (l - 1) q), so that deeper levels get
+    smaller weights, at a rate q taken from `hierarchy`. For every parameter point and frequency,
+    the weighted functional L(ξ) must satisfy the energy equivalence
+    lower |U|^2 <= L(ξ) <= upper |U|^2, and the dissipation matrix
+    D(ξ) = E(ξ)^* L(ξ) + L(ξ) E(ξ), E(ξ) = iξA + B, must be positive definite.
+    All checks are batched eigenvalue computations over parameter points and frequencies.
+
+    For each rate q in turn, the largest admissible ε on a logarithmic grid is found
+    first, then refined by bisection (in log scale) against the next grid value.
+
+    The smallest eigenvalue of D is only trusted if it is well above the roundoff of the
+    float64 computation: D = E^* L + L E is a sum of terms of size ‖E(ξ)‖ ‖L_l‖ for the
+    weighted levels L_l, so its entries and eigenvalues carry an error of about
+    n * machine ε * 2 ‖E(ξ)‖ Σ ‖L_l‖, which is much larger than ‖D‖ at high frequencies,
+    where these terms cancel. The relative margin λ_min(D) / ‖D‖ must exceed safety times
+    this bound (relative to ‖D‖) at every point and frequency.
+
+    This is a sufficient check on samples, not a proof, and it can fail for a valid tree:
+    the admissible weights may follow another hierarchy than ε^(1 + (l - 1) q), or the
+    positivity of D may only hold beyond the sampled frequencies, or below the roundoff
+    level (e.g. when D is definite only to high order in 1/ξ).
+
+    Args:
+        terms: Iterable of functional terms (see iter_lyapunov_terms), with numeric or
+            parametric coefficients (e.g. m)
+        A: Matrix A
+        B: Matrix B (= Bs + Ba)
+        params: Symbols appearing in A, B and the terms. Defaults to all free symbols
+        samples: Parameter points, as an array of shape (P, len(params)) or a dict
+        xi_grid: Frequencies at which the conditions are checked (default: 1 to 10^3)
+        lower, upper: Bounds of the energy equivalence
+        epsilon_grid: Candidate values of ε, in decreasing order (default: 1 to 10^-8)
+        hierarchy: Rates q to try, in order of preference
+        iterations: Number of bisection steps
+        rtol: Smallest relative margin λ_min(D) / ‖D‖ accepted for the positivity of D
+        safety: Factor above the roundoff bound that the relative margin must reach
+
+    Returns:
+        dict with:
+        - 'status': 'admissible' or 'failed'
+        - 'epsilon': largest admissible ε found (None if failed)
+        - 'hierarchy': rate q of the weights
+        - 'weights': {level: ε_level}
+        - 'certificate': margins of the energy equivalence and dissipation at ε
+          ('dissipation_margin', the smallest λ_min(D) / ‖D‖, and 'roundoff_ratio', the
+          smallest ratio of that margin to the required one, above 1), together with the
+          parameter points and frequencies where they were checked
+    """
+    terms = list(terms)
+    if params is None:
+        params = free_parameters(A, B, *[term_coefficient_matrix(term) for term in terms])
+    params = list(params)
+    points = parameter_points(params, samples)
+    if xi_grid is None:
+        xi_grid = np.logspace(0, 3, 40)
+    xi_grid = np.asarray(xi_grid, dtype=float)
+    if epsilon_grid is None:
+        epsilon_grid = np.logspace(0, -8, 17)
+
+    # Both L(ξ) and D(ξ) = E(ξ)^* L(ξ) + L(ξ) E(ξ) are linear in the weights: evaluate them by level once
+    kernels = compile_kernels(terms, A, B, params)
+    by_level = kernels.by_level('L', xi_grid, points)
+    dissipation_by_level = kernels.by_level('D', xi_grid, points)
+    levels = sorted(level for level in by_level if level > 0)
+    # Sizes of E(ξ) and of the levels of L, for the roundoff bound of D
+    A_values = lambdify_matrix(A, params)(points)[:, None]
+    B_values = lambdify_matrix(B, params)(points)[:, None]
+    E_norms = np.linalg.norm(1j * xi_grid[None, :, None, None] * A_values + B_values, axis=(-2, -1))
+    energy_norms = {level: np.linalg.norm(L, axis=(-2, -1)) for level, L in by_level.items()}
+    roundoff = safety * A.rows * np.finfo(float).eps
+
+    def weights(epsilon, rate):
+        return {level: epsilon ** (1 + (level - 1) * rate) for level in levels}
+
+    def margins(epsilon, rate):
+        """Energy bounds, dissipation margin and its ratio to the required margin, weighted by ε."""
+        L = by_level[0].copy()
+        D = dissipation_by_level[0].copy()
+        parts = energy_norms[0].copy()
+        for level, weight in weights(epsilon, rate).items():
+            L = L + weight * by_level[level]
+            D = D + weight * dissipation_by_level[level]
+            parts = parts + weight * energy_norms[level]
+        energy = np.linalg.eigvalsh(L)
+        dissipation = np.linalg.eigvalsh(D)
+        scale = np.abs(dissipation).max(axis=-1)
+        scale[scale == 0] = 1
+        relative = dissipation[..., 0] / scale
+        required = np.maximum(rtol, roundoff * 2 * E_norms * parts / scale)
+        return energy.min(), energy.max(), relative.min(), (relative / required).min()
+
+    def admissible(epsilon, rate):
+        energy_min, energy_max, _, roundoff_ratio = margins(epsilon, rate)
+        return energy_min >= lower and energy_max <= upper and roundoff_ratio > 1
+
+    for rate in hierarchy:
+        # Coarse scan: largest admissible grid value
+        found = None
+        for k, epsilon in enumerate(epsilon_grid):
+            if admissible(epsilon, rate):
+                found = k
+                break
+
+        if found is None:
+            continue
+
+        # Refine between the admissible value and the previous (larger) grid value
+        good = epsilon_grid[found]
+        if found > 0:
+            bad = epsilon_grid[found - 1]
+            for _ in range(iterations):
+                middle = np.sqrt(good * bad)
+                if admissible(middle, rate):
+                    good = middle
+                else:
+                    bad = middle
+
+        energy_min, energy_max, dissipation_margin, roundoff_ratio = margins(good, rate)
+        return {
+            'status': 'admissible',
+            'epsilon': float(good),
+            'hierarchy': rate,
+            'weights': {level: float(weight) for level, weight in weights(good, rate).items()},
+            'certificate': {
+                'energy_bounds': (float(energy_min), float(energy_max)),
+                'dissipation_margin': float(dissipation_margin),
+                'roundoff_ratio': float(roundoff_ratio),
+                'parameters': [str(p) for p in params],
+                'points': points,
+                'xi_grid': xi_grid
+            }
+        }
+
+    return {
+        'status': 'failed',
+        'epsilon': None,
+        'hierarchy': None,
+        'weights': {},
+        'certificate': None
+    }
+
+
+def certify_epsilon_weights(terms, A, B, samples=None, count=3, seed=0):
+    """
+    ε weights of a functional for the analysis output (see compute_epsilon_weights).
+
+    Unless samples are given, the parameters of A and B are drawn at `count` points in
+    [1/2, 2], with a fixed seed so that the output is reproducible. A functional where m is
+    free (a direction-0 node without a constant m) cannot be checked on samples of the
+    parameters alone, and is reported as not certified.
+
+    Returns:
+        JSON-serializable dict with:
+        - 'certified': True if admissible weights were found
+        - 'epsilon', 'hierarchy', 'weights', 'dissipation_margin': as in compute_epsilon_weights
+          (None and {} if not certified)
+        - 'reason': why the functional is not certified, None if it is
+    """
+    terms = list(terms)
+    params = free_parameters(A, B)
+    free = set(free_parameters(*[term_coefficient_matrix(term) for term in terms])) - set(params)
+    result = {'certified': False, 'epsilon': None, 'hierarchy': None, 'weights': {},
+              'dissipation_margin': None, 'reason': None}
+    if free:
+        result['reason'] = (f"the functional depends on {', '.join(sorted(str(p) for p in free))}, "
+                            f"which has no constant value")
+        return result
+
+    if samples is None:
+        rng = np.random.default_rng(seed)
+        samples = rng.uniform(0.5, 2, size=(count if params else 1, len(params)))
+    weights = compute_epsilon_weights(terms, A, B, params=params, samples=samples)
+    if weights['status'] != 'admissible':
+        result['reason'] = ("no weights ε^(1 + (l - 1) q) with a dissipation margin above roundoff "
+                            "on the sampled parameters and frequencies")
+        return result
+
+    result.update(certified=True, epsilon=weights['epsilon'], hierarchy=weights['hierarchy'],
+                  weights=weights['weights'], dissipation_margin=weights['certificate']['dissipation_margin'])
+    return result
+
+
+def print_epsilon_weights(result):
+    """Print the ε weights and their certificate."""
+    if result['status'] != 'admissible':
+        print("No admissible ε found on the given parameter points and frequencies, with a dissipation margin "
+              "above roundoff. This does not mean that the tree is wrong: the check only tries the weights "
+              "ε^(1 + (l - 1) q) on samples.")
+        return
+
+    certificate = result['certificate']
+    print(f"Admissible ε = {result['epsilon']:.6g} (weights ε^(1 + (l - 1) q), q = {result['hierarchy']}), "
+          f"relative dissipation margin {certificate['dissipation_margin']:.3g} "
+          f"({certificate['roundoff_ratio']:.3g} times the required margin)")
+    for level, weight in result['weights'].items():
+        print(f"  Level {level}: ε_{level} = {weight:.6g}")
+
+    energy_min, energy_max = certificate['energy_bounds']
+    print(f"Energy equivalence: {energy_min:.6g} |U|^2 <= L <= {energy_max:.6g} |U|^2")
+    print(f"Checked on {len(certificate['points'])} parameter point(s) ({', '.join(certificate['parameters'])}) "
+          f"and {len(certificate['xi_grid'])} frequencies in "
+          f"[{certificate['xi_grid'].min():.3g}, {certificate['xi_grid'].max():.3g}]")
+
+
+def print_epsilon_certificate(result):
+    """Print the ε weights of the analysis output (see certify_epsilon_weights)."""
+    if not result['certified']:
+        print(f"ε weights: not certified, {result['reason']}. This does not mean that the tree is wrong.")
+        return
+
+    print(f"ε weights: certified on sampled parameters and frequencies, ε = {result['epsilon']:.6g} "
+          f"(weights ε^(1 + (l - 1) q), q = {result['hierarchy']}), "
+          f"relative dissipation margin {result['dissipation_margin']:.3g}")
+    for level, weight in result['weights'].items():
+        print(f"  Level {level}: ε_{level} = {weight:.6g}")
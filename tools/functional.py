@@ -1,4 +1,48 @@
-from sympy import *
+from sympy import Add, collect, expand, simplify, zeros
+
+
+def normalize_bilinear(expr, d_x_u, u):
+    """
+    Canonical form of the bilinear part of expr in (d_x_u, u).
+
+    The coefficient matrix C of the terms C[i, j] * d_x_u[i] * u[j] is extracted in a
+    single pass over the expanded expression. Then the diagonal is dropped and the
+    lower triangle (i > j) is folded onto the upper one, putting the derivative on
+    the smallest index. All other terms are kept unchanged.
+
+    Args:
+        expr: SymPy expression
+        d_x_u: Sequence of symbols for the derivatives of u
+        u: Sequence of symbols for u
+
+    Returns:
+        The normalized expression
+    """
+    size = len(u)
+    positions = {}
+    for i in range(size):
+        for j in range(size):
+            positions[d_x_u[i] * u[j]] = (i, j)
+
+    C = zeros(size, size)
+    rest = []
+    for term in Add.make_args(expand(expr)):
+        coeff, monomial = term.as_independent(*d_x_u, *u, as_Add=False)
+        position = positions.get(monomial)
+        if position is None:
+            rest.append(term)
+        else:
+            C[position] += coeff
+
+    # Integration by parts rules as matrix operations
+    canonical = []
+    for i in range(size):
+        for j in range(i + 1, size):
+            entry = C[i, j] + C[j, i]
+            if entry != 0:
+                canonical.append(entry * d_x_u[i] * u[j])
+
+    return Add(*rest, *canonical)
 
 
 class Operator:
@@ -24,15 +68,8 @@ class Operator:
         result = - term1 - term2 - term3 + term4 - term5 - term6
         result = expand(result)
 
-        # Remove terms of the form d_x_u{i}*u{i}
-        for i in range(1, self.size + 1):
-            result = result.subs(self.d_x_u[i - 1] * self.u[i - 1], 0)
-
-        # Put the derivative on the smallest index
-        for i in range(1, self.size + 1):
-            for j in range(i + 1, self.size + 1):
-                result = result.subs(self.d_x_u[j - 1] * self.u[i - 1],
-                                         self.d_x_u[i - 1] * self.u[j - 1])
+        # Drop d_x_u{i}*u{i} and put the derivative on the smallest index
+        result = normalize_bilinear(result, self.d_x_u, self.u)
 
         # Collect and simplify the expression
         result = collect(result, self.d_x_u)
@@ -51,15 +88,8 @@ class Operator:
 
         result = - term1 + term2 + term3 + term4 + term5 + term6
 
-        # Remove terms of the form d_x_u{i}*u{i}
-        for i in range(1, self.size + 1):
-            result = result.subs(self.d_x_u[i - 1] * self.u[i - 1], 0)
-
-        # Put the derivative on the smallest index
-        for i in range(1, self.size + 1):
-            for j in range(i + 1, self.size + 1):
-                result = result.subs(self.d_x_u[j - 1] * self.u[i - 1],
-                                         self.d_x_u[i - 1] * self.u[j - 1])
+        # Drop d_x_u{i}*u{i} and put the derivative on the smallest index
+        result = normalize_bilinear(result, self.d_x_u, self.u)
 
         # Collect and simplify the expression
         result = collect(result, self.d_x_u)
@@ -79,15 +109,8 @@ class Operator:
 
         result = - term1 + term2 - term3 + term4 - term5 - term6
 
-        # Remove terms of the form d_x_u{i}*u{i}
-        for i in range(1, self.size + 1):
-            result = result.subs(self.d_x_u[i - 1] * self.u[i - 1], 0)
-
-        # Put the derivative on the smallest index
-        for i in range(1, self.size + 1):
-            for j in range(i + 1, self.size + 1):
-                result = result.subs(self.d_x_u[j - 1] * self.u[i - 1],
-                                 self.d_x_u[i - 1] * self.u[j - 1])
+        # Drop d_x_u{i}*u{i} and put the derivative on the smallest index
+        result = normalize_bilinear(result, self.d_x_u, self.u)
 
         # Collect and simplify the expression
         result = collect(result, self.d_x_u)
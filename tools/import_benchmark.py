@@ -0,0 +1,74 @@
+"""
+Import-time benchmark guarding the startup of the command line interface.
+
+Run it from the project folder with:
+    python -m tools.import_benchmark
+
+Every check runs in a fresh interpreter. It fails (exit code 1) if the menu and the
+argument parsing pull in SymPy or NumPy or exceed the startup budget on top of a bare
+interpreter, or if the symbolic pipeline pulls in NumPy (only the float64 paths need it).
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('sympy', 'numpy')
+
+# (name, code, must stay light, modules it must not load)
+CHECKS = [
+    ("bare interpreter", "pass", True, HEAVY_MODULES),
+    ("main module (menu, argument parsing)", "import main", True, HEAVY_MODULES),
+    ("menu", "import tools.menu", True, HEAVY_MODULES),
+    ("symbolic pipeline", "import tools.tree, tools.latex, tools.numeric, tools.locus, tools.analysis",
+     False, ('numpy',)),
+]
+
+
+def run_check(code, repeat):
+    """Best wall time of `code` in a fresh interpreter, and the heavy modules it loaded."""
+    probe = f"{code}\nimport sys\nprint(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    best = None
+    loaded = ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        loaded = output.stdout.strip()
+    return best, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the startup time of the command line interface.")
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help="allowed overhead in seconds over a bare interpreter (default: 0.05)")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per check, the best is kept (default: 5)")
+    args = parser.parse_args()
+
+    baseline = None
+    failures = []
+    for name, code, light, forbidden in CHECKS:
+        elapsed, loaded = run_check(code, args.repeat)
+        if baseline is None:
+            baseline = elapsed
+        overhead = elapsed - baseline
+        print(f"{name:40s} {elapsed * 1000:8.1f} ms  (+{overhead * 1000:7.1f} ms)  heavy modules: {loaded or '-'}")
+
+        unwanted = [module for module in loaded.split(',') if module in forbidden]
+        if unwanted:
+            failures.append(f"{name} imports {', '.join(unwanted)}")
+        if light and overhead > args.budget:
+            failures.append(f"{name} takes {overhead * 1000:.1f} ms over the budget of {args.budget * 1000:.1f} ms")
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
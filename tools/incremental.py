@@ -0,0 +1,156 @@
+from tools.cache import load_caches, store_product
+from tools.tree import explore_tree, iter_nodes, make_root
+
+
+def changed_entries(old, new):
+    """Positions (i, j) where two matrices of the same shape differ."""
+    return {(i, j) for i in range(old.rows) for j in range(old.cols) if old[i, j] != new[i, j]}
+
+
+def nonzero_entries(*matrices):
+    """Positions (i, j) that are nonzero in any of the matrices (the union of their sparsity patterns)."""
+    return {(i, j) for matrix in matrices for i in range(matrix.rows) for j in range(matrix.cols)
+            if matrix[i, j] != 0}
+
+
+def propagate_change(X_pattern, X_changed, F_pattern, F_changed, cols):
+    """
+    Entries of a product X*F that may change, from the sparsity patterns of the factors.
+
+    The entry (r, c) is the sum of X[r, k] F[k, c]: it changes only if one of its
+    terms has a changed factor and a possibly nonzero other factor.
+    """
+    changed = set()
+    for r, k in X_changed:
+        changed.update((r, c) for c in range(cols) if (k, c) in F_pattern)
+    for k, c in F_changed:
+        changed.update((r, c) for r, k2 in X_pattern if k2 == k)
+    return changed
+
+
+def update_product(old_product, X, F, changed):
+    """X*F, recomputing only the changed entries of the old product."""
+    product = old_product.copy()
+    for r, c in changed:
+        product[r, c] = (X.row(r) * F.col(c))[0]
+    return product
+
+
+def reanalyze(root, old_system, new_system, size, cache_path=None, max_iterations=10):
+    """
+    Explore the tree again after a small change of A or B, reusing the previous run.
+
+    The change is propagated through the words of the previous tree: the entries of a
+    node matrix X*F that depend on a changed entry of X or of F (A or Ba) are found from
+    the sparsity patterns, and only those are recomputed. The updated products are put
+    in the product cache, so that explore_tree takes them from there, and the rank of
+    every stack that did not change comes from the rank cache of the previous run (kept
+    in this process, or loaded from cache_path). Only the products and ranks that depend
+    on the changed entries are computed again.
+
+    Args:
+        root: Root of the tree of the previous run (explore_tree)
+        old_system, new_system: (A, Ba, Bs) before and after the change
+        cache_path: File of the caches of the previous run (see save_caches), if it ran
+            in another process
+
+    Returns:
+        dict with:
+        - 'root', 'final_rank': the new tree and the rank reached, as explore_tree
+        - 'changed_products': names of the nodes whose matrix changed
+        - 'changed_decisions': names of the previous nodes whose rank decision had to be
+          computed again (their M, X, X*A or X*Ba changed)
+        - 'reused_entries', 'recomputed_entries': entries of the node matrices reused
+          from the previous run and recomputed
+        - 'diff': list of (node name, old direction, new direction) of the nodes whose
+          direction changed, with 'absent' for the nodes only in one of the trees
+    """
+    if cache_path is not None:
+        load_caches(cache_path)
+
+    A_old, Ba_old, Bs_old = old_system
+    A_new, Ba_new, Bs_new = new_system
+    n = A_new.cols
+    factors = {
+        'A': (A_new, nonzero_entries(A_old, A_new), changed_entries(A_old, A_new)),
+        'Ba': (Ba_new, nonzero_entries(Ba_old, Ba_new), changed_entries(Ba_old, Ba_new))
+    }
+
+    # New matrix and changed entries of every word of the previous tree, top-down. A
+    # factored root is a row basis of Bs: if its shape changes, everything is recomputed
+    factored = root.matrix != Bs_old
+    root_new = make_root(Bs_new, factored).matrix
+    if root_new.shape == root.matrix.shape:
+        root_changed = changed_entries(root.matrix, root_new)
+    else:
+        root_changed = {(i, j) for i in range(root_new.rows) for j in range(root_new.cols)}
+    updated = {root.name: (root_new, root_changed)}
+    reused_entries = 0
+    recomputed_entries = 0
+    for node in iter_nodes(root):
+        X_new, X_changed = updated[node.name]
+        X_pattern = nonzero_entries(node.matrix) | X_changed
+        for child in node.children:
+            factor = 'A' if child.name.endswith(' A') else 'Ba'
+            F_new, F_pattern, F_changed = factors[factor]
+            if X_new.shape == node.matrix.shape:
+                changed = propagate_change(X_pattern, X_changed, F_pattern, F_changed, n)
+                child_new = update_product(child.matrix, X_new, F_new, changed)
+            else:
+                child_new = X_new * F_new
+                changed = {(i, j) for i in range(child_new.rows) for j in range(n)}
+            store_product(X_new, F_new, child_new)
+            updated[child.name] = (child_new, changed)
+            recomputed_entries += len(changed)
+            reused_entries += child_new.rows * child_new.cols - len(changed)
+
+    # A decision depends on M (all the nodes of the previous levels), on X, X*A and X*Ba
+    changed_decisions = []
+    stack_changed = bool(updated[root.name][1])
+    level_nodes = [root]
+    while level_nodes:
+        for node in level_nodes:
+            if not node.processed:
+                continue
+            X_changed = updated[node.name][1]
+            X_pattern = nonzero_entries(node.matrix) | X_changed
+            products_changed = any(propagate_change(X_pattern, X_changed, F_pattern, F_changed, n)
+                                   for _, F_pattern, F_changed in factors.values())
+            if stack_changed or X_changed or products_changed:
+                changed_decisions.append(node.name)
+        children = [child for node in level_nodes for child in node.children]
+        stack_changed = stack_changed or any(updated[child.name][1] for child in children)
+        level_nodes = children
+
+    new_root, final_rank = explore_tree(A_new, Ba_new, Bs_new, size, max_iterations, factored=factored)
+
+    old_directions = {node.name: node.direction for node in iter_nodes(root) if node.processed}
+    new_directions = {node.name: node.direction for node in iter_nodes(new_root) if node.processed}
+    diff = []
+    for name in list(old_directions) + [name for name in new_directions if name not in old_directions]:
+        old_direction = old_directions.get(name, 'absent')
+        new_direction = new_directions.get(name, 'absent')
+        if old_direction != new_direction:
+            diff.append((name, old_direction, new_direction))
+
+    return {
+        'root': new_root,
+        'final_rank': final_rank,
+        'changed_products': [name for name, (_, changed) in updated.items() if changed],
+        'changed_decisions': changed_decisions,
+        'reused_entries': reused_entries,
+        'recomputed_entries': recomputed_entries,
+        'diff': diff
+    }
+
+
+def print_direction_diff(result):
+    """Print what the re-analysis recomputed and which directions changed."""
+    total = result['reused_entries'] + result['recomputed_entries']
+    print(f"Node matrices: {result['recomputed_entries']} of {total} entries recomputed, "
+          f"changed at {result['changed_products'] or 'no node'}")
+    print(f"Rank decisions recomputed at {result['changed_decisions'] or 'no node'}")
+    if not result['diff']:
+        print("No direction changed")
+    for name, old_direction, new_direction in result['diff']:
+        print(f"  {name}: {old_direction} -> {new_direction}")
@@ -0,0 +1,260 @@
+import hashlib
+import inspect
+import os
+import numpy as np
+from sympy import I, Symbol, lambdify, srepr
+from sympy.printing.numpy import NumPyPrinter
+from tools.numeric import free_parameters, term_coefficient_matrix
+
+# Bump when the generated kernels change, so that old files on disk are not reused
+KERNEL_VERSION = 2
+
+# Compiled kernels of this process, by functional key
+_kernels = {}
+
+
+def default_cache_dir():
+    """Folder of the kernels cached on disk ($HYPERNONSYM_KERNEL_CACHE, or ~/.cache/hypernonsym/kernels)."""
+    return os.environ.get('HYPERNONSYM_KERNEL_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'hypernonsym', 'kernels'))
+
+
+def term_groups(terms):
+    """
+    Sum the coefficient matrices of the terms sharing (level, derivative, xi_exp).
+
+    Returns:
+        dict {(level, derivative, xi_exp): S}, with S = Σ coefficient * left^T right
+    """
+    groups = {}
+    for term in terms:
+        key = (term['level'], term['derivative'], term['xi_exp'])
+        S = term_coefficient_matrix(term)
+        groups[key] = groups[key] + S if key in groups else S
+    return groups
+
+
+def functional_key(groups, A, B, params):
+    """Hash of a functional (its term groups), of the system and of the parameter order."""
+    content = [KERNEL_VERSION, [str(p) for p in params], srepr(A), srepr(B)]
+    content += [(key, srepr(S)) for key, S in sorted(groups.items())]
+    return hashlib.sha256(repr(content).encode('utf-8')).hexdigest()
+
+
+def fourier_symbols(groups, A, B, xi):
+    """
+    Symbolic matrices of the functional and of its dissipation in Fourier variables, by level.
+
+    By Parseval a group S (∂_x)^d / ξ^e contributes the Hermitian part of S (iξ)^d / ξ^e,
+    i.e. (S + S^T)/2 / ξ^e without derivative and iξ (S - S^T)/2 / ξ^e with it (the
+    parameters are real). Along solutions of U_t + A U_x + B U = 0 the functional Û^* L Û
+    decreases as -Û^* D Û, with D = E^* L + L E and E = iξA + B: this is the Fourier form
+    of the products that Operator expands in physical variables.
+
+    Returns:
+        (L, D): dicts {level: Matrix}. D is empty if A or B is None
+    """
+    L = {}
+    for (level, derivative, xi_exp), S in groups.items():
+        if derivative:
+            contribution = I * xi * (S - S.T) / 2 / xi ** xi_exp
+        else:
+            contribution = (S + S.T) / 2 / xi ** xi_exp
+        L[level] = L[level] + contribution if level in L else contribution
+
+    D = {}
+    if A is not None and B is not None:
+        E = I * xi * A + B
+        E_star = -I * xi * A.T + B.T
+        for level, L_level in L.items():
+            D[level] = (E_star * L_level + L_level * E).expand()
+    return L, D
+
+
+def kernel_source(name, matrices, xi, params):
+    """
+    Python source of a function name(xi, *params) returning the entries of the matrices.
+
+    The code is generated by lambdify with fully qualified NumPy calls, so that it only
+    needs `numpy` in its namespace and can be stored on disk as is.
+    """
+    entries = [entry for matrix in matrices for entry in matrix]
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    function = lambdify([xi] + list(params), entries, modules='numpy', printer=printer, cse=True)
+    return inspect.getsource(function).replace('def _lambdifygenerated(', f'def {name}(', 1)
+
+
+def is_private(path):
+    """
+    True if a file or folder belongs to the current user and nobody else can write to it.
+
+    The kernel files are executed: a cache that other users can write to (e.g. a shared
+    $HYPERNONSYM_KERNEL_CACHE) would let them run code in every process that loads it.
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & 0o022
+
+
+def source_digest(body):
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def read_cached_source(path):
+    """
+    Source of a kernel file, or None if it is missing, not private (see is_private) or
+    does not match the SHA-256 of its first line (e.g. a partial write).
+    """
+    if not is_private(os.path.dirname(path)) or not is_private(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            first_line = f.readline()
+            body = f.read()
+    except OSError:
+        return None
+    if first_line.strip() != f"# SHA256 {source_digest(body)}":
+        return None
+    return body
+
+
+def write_cached_source(path, source):
+    """Store a kernel file, readable and writable by the current user only."""
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    if not is_private(cache_dir):
+        # Never write code where others could replace it
+        return
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+        f.write(f"# SHA256 {source_digest(source)}\n")
+        f.write(source)
+    os.replace(temporary, path)
+
+
+def load_source(source):
+    """Execute the source of a kernel file and return its namespace."""
+    namespace = {'numpy': np}
+    exec(compile(source, '<fourier kernels>', 'exec'), namespace)
+    return namespace
+
+
+class FourierKernels:
+    """NumPy kernels L(ξ, p) and D(ξ, p) of a functional, by level."""
+
+    def __init__(self, key, params, levels, size, namespace, source):
+        self.key = key
+        self.params = list(params)
+        self.levels = list(levels)
+        self.size = size
+        self.source = source
+        self._functions = {kind: namespace.get(f'kernel_{kind}') for kind in ('L', 'D')}
+
+    @property
+    def has_dissipation(self):
+        return self._functions['D'] is not None
+
+    def by_level(self, kind, xi, points):
+        """
+        Evaluate the matrices of one kind ('L' or 'D') of every level.
+
+        Args:
+            xi: Frequencies, array of shape (X,)
+            points: Parameter points, array of shape (P, len(params))
+
+        Returns:
+            dict {level: array of shape (P, X, n, n)}
+        """
+        function = self._functions[kind]
+        if function is None:
+            raise ValueError(f"No {kind} kernel: the kernels were compiled without A and B")
+
+        xi = np.asarray(xi, dtype=float)
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        shape = (points.shape[0], xi.shape[0])
+        values = function(xi[None, :], *[points[:, j, None] for j in range(points.shape[1])])
+
+        # Constant entries come back as scalars: broadcast them over points and frequencies
+        n = self.size
+        result = np.empty(shape + (len(self.levels) * n * n,), dtype=complex)
+        for k, value in enumerate(values):
+            result[..., k] = np.broadcast_to(value, shape)
+        result = result.reshape(shape + (len(self.levels), n, n))
+        return {level: result[..., index, :, :] for index, level in enumerate(self.levels)}
+
+    def matrix(self, kind, xi, points, weights=None):
+        """Weighted sum Σ weights[level] * matrix of the level (weight 1 if missing), shape (P, X, n, n)."""
+        if weights is None:
+            weights = {}
+        return sum(weights.get(level, 1) * matrices for level, matrices in self.by_level(kind, xi, points).items())
+
+
+def compile_kernels(terms, A=None, B=None, params=None, cache_dir=None):
+    """
+    Compile the Fourier matrices of a functional into NumPy kernels, once.
+
+    The kernels are kept for the rest of the process and, unless cache_dir is False,
+    stored on disk as generated source code, keyed by the hash of the functional, of A
+    and B and of the parameter order. Any later verification, sweep or simulation of the
+    same functional loads them back without building and lambdifying the matrices again.
+    A file is only loaded from a private folder, if it is private itself and matches the
+    hash of its content (see read_cached_source).
+
+    Args:
+        terms: Iterable of functional terms (see iter_lyapunov_terms)
+        A, B: Matrices of the system, needed for the dissipation kernel D
+        params: Parameter symbols, in the order of the points. Defaults to all free symbols
+        cache_dir: Folder of the cache on disk (default: default_cache_dir()), False to disable it
+
+    Returns:
+        FourierKernels
+    """
+    groups = term_groups(terms)
+    if params is None:
+        extra = [m for m in (A, B) if m is not None]
+        params = free_parameters(*extra, *groups.values())
+    params = list(params)
+    key = functional_key(groups, A, B, params)
+
+    kernels = _kernels.get(key)
+    if kernels is not None:
+        return kernels
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    path = os.path.join(cache_dir, f'{key}.py') if cache_dir else None
+
+    source = read_cached_source(path) if path is not None else None
+
+    if source is None:
+        xi = Symbol('xi', positive=True)
+        L, D = fourier_symbols(groups, A, B, xi)
+        levels = sorted(L)
+        size = next(iter(groups.values())).rows if groups else (A.rows if A is not None else 0)
+        header = (f"# Fourier kernels of a functional, generated by tools/kernels.py\n"
+                  f"PARAMS = {[str(p) for p in params]!r}\nLEVELS = {levels!r}\nSIZE = {size!r}\n\n")
+        source = header + kernel_source('kernel_L', [L[level] for level in levels], xi, params)
+        if D:
+            source += '\n' + kernel_source('kernel_D', [D[level] for level in levels], xi, params)
+
+        if path is not None:
+            try:
+                write_cached_source(path, source)
+            except OSError:
+                # The cache on disk is only an optimization
+                pass
+
+    namespace = load_source(source)
+    kernels = FourierKernels(key, params, namespace['LEVELS'], namespace['SIZE'], namespace, source)
+    _kernels[key] = kernels
+    return kernels
+
+
+def clear_kernels():
+    """Forget the kernels compiled in this process (the files on disk are kept)."""
+    _kernels.clear()
+
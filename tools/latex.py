@@ -1,5 +1,5 @@
-from sympy import *
-from tools.matrix import *
+import tempfile
+from sympy import Matrix, latex, symbols
 
 
 def generate_l2_latex(vec1, vec2):
@@ -83,7 +83,7 @@ def generate_l2_latex(vec1, vec2):
     return result
 
 
-def compute_m_symbolic(X, A, Ba, U):
+def compute_m_symbolic(X, A, Ba, U, gram=None):
     """
     Compute the symbolic value of m that satisfies:
     ⟨XAU, -XBaU + mXBaA²U⟩ = 0
@@ -95,14 +95,16 @@ def compute_m_symbolic(X, A, Ba, U):
         A: Matrix A
         Ba: Matrix Ba (antisymmetric part of B)
         U: Vector U
+        gram: Gram matrix of a factored tree (node.gram), weighting the left side
 
     Returns:
         Symbolic expression for m, or None if denominator is zero
     """
-    from sympy import simplify, Matrix
+    from sympy import simplify
+    from tools.tree import weighted
 
     # Compute the vectors for the scalar products
-    XAU = X * A * U
+    XAU = weighted(gram, X * A * U)
     XBaU = X * Ba * U
     XBaA2U = X * Ba * A * A * U
 
@@ -128,7 +130,74 @@ def compute_m_symbolic(X, A, Ba, U):
     return m
 
 
-def check_cancellations(X, A, Ba, U, m_value):
+def solve_mixing_coefficients(root, A, Ba):
+    """
+    Solve for the m of every direction-0 node of the tree at once.
+
+    For a node X, m must satisfy ⟨XAU, XBaU⟩ = m ⟨XAU, XBaA²U⟩ for every U, i.e. one
+    linear equation in m for each entry of the symmetric matrices of the two quadratic
+    forms. The equations of all the nodes are stacked into a single sparse system over
+    the polynomial ring of the parameters, and each unknown is eliminated fraction-free:
+    with a pivot equation c_p m = d_p, every other equation c_e m = d_e of the node must
+    satisfy d_e c_p - c_e d_p = 0, and then m = d_p / c_p.
+
+    Returns:
+        dict {node: m}, with m None for the nodes where no constant m exists (or the
+        quadratic form ⟨XAU, XBaA²U⟩ vanishes)
+    """
+    from sympy import cancel, zeros
+    from sympy.polys.matrices import DomainMatrix
+    from tools.tree import iter_nodes, weighted
+    from tools.backend import product
+
+    mixed_nodes = [node for node in iter_nodes(root) if node.direction == 0]
+    if not mixed_nodes:
+        return {}
+
+    def symmetric(P, Q):
+        # Matrix of the quadratic form U -> ⟨PU, QU⟩
+        S = product(P.T, Q)
+        return (S + S.T) / 2
+
+    # Stacked sparse system: one column per node, right-hand side in the last column
+    n = A.rows
+    upper = [(i, j) for i in range(n) for j in range(i, n)]
+    system = zeros(len(upper) * len(mixed_nodes), len(mixed_nodes) + 1)
+    for k, node in enumerate(mixed_nodes):
+        X = node.matrix
+        XA = weighted(node.gram, X * A)
+        S_lhs = symmetric(XA, X * Ba * A * A)
+        S_rhs = symmetric(XA, X * Ba)
+        for e, (i, j) in enumerate(upper):
+            system[k * len(upper) + e, k] = S_lhs[i, j]
+            system[k * len(upper) + e, -1] = S_rhs[i, j]
+
+    dm = DomainMatrix.from_Matrix(system)
+    domain = dm.domain
+    rows = dm.to_dod()
+    rhs_col = len(mixed_nodes)
+
+    m_values = {}
+    for k, node in enumerate(mixed_nodes):
+        block = [rows.get(k * len(upper) + e, {}) for e in range(len(upper))]
+        equations = [(row.get(k, domain.zero), row.get(rhs_col, domain.zero)) for row in block if row]
+
+        pivot = next(((c, d) for c, d in equations if c), None)
+        if pivot is None:
+            m_values[node] = None
+            continue
+
+        c_p, d_p = pivot
+        if any(d * c_p - c * d_p for c, d in equations):
+            m_values[node] = None
+            continue
+
+        m_values[node] = cancel(domain.to_sympy(d_p) / domain.to_sympy(c_p))
+
+    return m_values
+
+
+def check_cancellations(X, A, Ba, U, m_value, gram=None):
     """
     Check for parameter cancellations by solving:
     ⟨XU - mXA²U, XBaAU⟩ = 0
@@ -139,6 +208,7 @@ def check_cancellations(X, A, Ba, U, m_value):
         Ba: Matrix Ba (antisymmetric part of B)
         U: Vector U
         m_value: The previously computed value of m
+        gram: Gram matrix of a factored tree (node.gram), weighting the left side
 
     Returns:
         dict with:
@@ -146,7 +216,8 @@ def check_cancellations(X, A, Ba, U, m_value):
         - 'expression': The simplified scalar product expression
         - 'status': 'solved', 'underdetermined', 'no_solution', or 'always_zero'
     """
-    from sympy import solve, simplify, Eq, symbols
+    from sympy import solve, simplify, Eq
+    from tools.tree import weighted
 
     # Compute the vectors for the scalar product
     XU = X * U
@@ -154,7 +225,7 @@ def check_cancellations(X, A, Ba, U, m_value):
     XBaAU = X * Ba * A * U
 
     # Compute the first vector: XU - m*XA²U
-    vec1 = XU - m_value * XA2U
+    vec1 = weighted(gram, XU - m_value * XA2U)
     vec2 = XBaAU
 
     # Compute the scalar product ⟨XU - mXA²U, XBaAU⟩
@@ -239,7 +310,7 @@ def check_cancellations(X, A, Ba, U, m_value):
             'parameters': actual_params
         }
 
-    except Exception as e:
+    except Exception:
         # print(f"Error solving for cancellations: {e}") # Removed for cleaner output
         return {
             'solutions': [],
@@ -249,15 +320,21 @@ def check_cancellations(X, A, Ba, U, m_value):
         }
 
 
-def analyze_cancellations(X, A, Ba, U):
+def analyze_cancellations(X, A, Ba, U, m_value=None, gram=None):
     """
     Complete analysis: compute m and check for cancellations.
 
+    Args:
+        m_value: The value of m if already known (e.g. from solve_mixing_coefficients).
+            It is computed with compute_m_symbolic otherwise.
+        gram: Gram matrix of a factored tree (node.gram)
+
     Returns:
         dict with both m computation and cancellation analysis
     """
     # First compute m
-    m_value = compute_m_symbolic(X, A, Ba, U)
+    if m_value is None:
+        m_value = compute_m_symbolic(X, A, Ba, U, gram)
 
     if m_value is None:
         return {
@@ -267,7 +344,7 @@ def analyze_cancellations(X, A, Ba, U):
         }
 
     # Then check for cancellations
-    cancellation_result = check_cancellations(X, A, Ba, U, m_value)
+    cancellation_result = check_cancellations(X, A, Ba, U, m_value, gram)
 
     return {
         'm_value': m_value,
@@ -276,104 +353,39 @@ def analyze_cancellations(X, A, Ba, U):
     }
 
 
-def functional_to_latex(A, Ba, U, root):
-    """Convert the Lyapunov functional to LaTeX format with symbolic m computation."""
-    from sympy import symbols
-
-    dx = symbols('dx')
-
-    base_term = r"\frac{1}{2}\|\mathbf{u}\|^2"
-    terms_by_level = {0: [base_term]}
-    cancellation_summaries = []  # List to store cancellation analysis results
-
-    def collect_terms(node, level=1):
-
-        if node.parent and node.parent.direction is not None:
-            if level not in terms_by_level:
-                terms_by_level[level] = []
-
-            xi_exp = 2 * (1 + node.number)
-            xi_factor = f"\\frac{{1}}{{\\xi^{{{xi_exp}}}}}"
-
-            if node.parent.direction == 1:
-                vec1 = node.parent.matrix * U
-                vec2 = node.matrix * dx * U
-                scalar_product = generate_l2_latex(vec1, vec2)
-                if scalar_product != "0":
-                    term = f"{xi_factor}\\left({scalar_product}\\right)"
-                    terms_by_level[level].append(term)
-
-            elif node.parent.direction == -1:
-                vec1 = node.parent.matrix * U
-                vec2 = node.matrix * U
-                scalar_product = generate_l2_latex(vec1, vec2)
-                if scalar_product != "0":
-                    term = f"{xi_factor}\\left({scalar_product}\\right)"
-                    terms_by_level[level].append(term)
-
-            elif node.parent.direction == 0:
-                # Compute m symbolically and check for cancellations
-                X = node.parent.matrix
-                analysis = analyze_cancellations(X, A, Ba, U)
-                cancellation_summaries.append({
-                    'node_info': f"Node at level {level}, name {node.name}",
-                    'analysis_result': analysis
-                })
-
-                if analysis['status'] == 'completed':
-                    m_symbolic = analysis['m_value']
-
-                    # Term 1: main term
-                    vec1_1 = node.parent.matrix * U
-                    vec2_1 = node.matrix * dx * U
-                    term1_latex = generate_l2_latex(vec1_1, vec2_1)
-
-                    # Term 2: mixed term with symbolic m
-                    vec1_2 = node.parent.matrix * A * U
-                    vec2_2 = node.parent.matrix * Ba * A * U
-                    term2_latex = generate_l2_latex(vec1_2, vec2_2)
-
-                    if term1_latex != "0":
-                        term1_line = f"{xi_factor}\\left({term1_latex}\\right)"
-                        terms_by_level[level].append(term1_line)
-
-                    if term2_latex != "0":
-                        # Convert symbolic m to LaTeX
-                        from sympy import latex
-                        m_latex = latex(m_symbolic)
-                        if m_latex == '1':
-                            term2_line = f"{xi_factor}\\left({term2_latex}\\right)"
-                        else:
-                            term2_line = f"{xi_factor}{m_latex}\\left({term2_latex}\\right)"
-                        terms_by_level[level].append(term2_line)
-
-                else:
-                    # Fall back to original behavior
-                    vec1_1 = node.parent.matrix * U
-                    vec2_1 = node.matrix * dx * U
-                    term1_latex = generate_l2_latex(vec1_1, vec2_1)
-
-                    vec1_2 = node.parent.matrix * A * U
-                    vec2_2 = node.parent.matrix * Ba * A * U
-                    term2_latex = generate_l2_latex(vec1_2, vec2_2)
+def term_to_latex(term, U, m_value=None):
+    """
+    LaTeX of one functional term, or None if its scalar product vanishes.
 
-                    if term1_latex != "0":
-                        term1_line = f"{xi_factor}\\left({term1_latex}\\right)"
-                        terms_by_level[level].append(term1_line)
+    Args:
+        term: Functional term (see iter_term_pairs)
+        U: Vector U
+        m_value: Value printed for the m of a mixed term (default: the term coefficient)
+    """
+    if term['kind'] == 'base':
+        return r"\frac{1}{2}\|\mathbf{u}\|^2"
 
-                    if term2_latex != "0":
-                        term2_line = f"{xi_factor}m\\left({term2_latex}\\right)"
-                        terms_by_level[level].append(term2_line)
+    dx = symbols('dx')
+    xi_factor = f"\\frac{{1}}{{\\xi^{{{term['xi_exp']}}}}}"
+    left, right = term['pair']
+    vec1 = left * U
+    vec2 = right * dx * U if term['derivative'] else right * U
+    scalar_product = generate_l2_latex(vec1, vec2)
+    if scalar_product == "0":
+        return None
 
-        for child in node.children:
-            collect_terms(child, level + 1)
+    if term['kind'] != 'mixed':
+        return f"{xi_factor}\\left({scalar_product}\\right)"
 
-    # Collect all terms
-    for child in root.children:
-        collect_terms(child, level=1)
+    # Mixed term with the m of the node, as in the functional
+    m_latex = latex(term['coefficient'] if m_value is None else m_value)
+    if m_latex == '1':
+        return f"{xi_factor}\\left({scalar_product}\\right)"
+    return f"{xi_factor}{m_latex}\\left({scalar_product}\\right)"
 
 
-    # Build LaTeX output
+def latex_from_levels(terms_by_level):
+    """Assemble the align* environment of the functional from the LaTeX terms of each level."""
     latex_output = r"\begin{align*}" + "\n"
     latex_output += r"\mathcal{L} &= " + terms_by_level[0][0]
 
@@ -387,8 +399,99 @@ def functional_to_latex(A, Ba, U, root):
                 latex_output += r" \\" + "\n" + r"&\quad+ " + (r" \\" + "\n" + r"&\quad+ ").join(filtered_terms)
 
     latex_output += r"\end{align*}"
+    return latex_output
+
+
+def latex_escape(text):
+    """Escape the characters of plain text that LaTeX would interpret."""
+    replacements = {'\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_',
+                    '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'}
+    return ''.join(replacements.get(character, character) for character in text)
+
 
-    # --- Print cancellation summary outside the recursion ---
+class LatexWriter:
+    """
+    Standalone LaTeX document of a functional, written with bounded memory.
+
+    The terms arrive in tree order but are printed level by level, as in
+    latex_from_levels: each level is spooled to its own temporary file, and close()
+    writes the document from them, in align* blocks of at most max_terms terms and about
+    max_chars characters, so that the size of a block does not grow with the functional.
+    """
+
+    def __init__(self, path, max_terms=20, max_chars=20000, title=None):
+        self.path = path
+        self.max_terms = max_terms
+        self.max_chars = max_chars
+        self.title = title
+        self.terms = 0
+        self.blocks = 0
+        self._levels = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def add(self, level, fragment):
+        """Add the LaTeX of one term of a level (zero terms are skipped)."""
+        if fragment == "0" or fragment.strip() == r"\left(0\right)":
+            return
+        spool = self._levels.get(level)
+        if spool is None:
+            spool = self._levels[level] = tempfile.TemporaryFile('w+', encoding='utf-8')
+        spool.write(fragment.replace('\n', ' ') + '\n')
+        self.terms += 1
+
+    def _discard(self):
+        for spool in self._levels.values():
+            spool.close()
+        self._levels = {}
+
+    def close(self):
+        """Write the document and delete the temporary files."""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write("\\documentclass{article}\n\\usepackage{amsmath}\n\\allowdisplaybreaks\n\\begin{document}\n")
+            if self.title:
+                f.write(f"\\section*{{{latex_escape(self.title)}}}\n")
+
+            first = True
+            for level in sorted(self._levels):
+                spool = self._levels[level]
+                spool.seek(0)
+                f.write(f"% Level {level}\n")
+                in_block = False
+                count = chars = 0
+                for line in spool:
+                    fragment = line.rstrip('\n')
+                    if in_block and (count >= self.max_terms or chars + len(fragment) > self.max_chars):
+                        f.write("\n\\end{align*}\n")
+                        in_block = False
+                    if in_block:
+                        f.write(" \\\\\n&\\quad+ ")
+                    else:
+                        f.write("\\begin{align*}\n")
+                        f.write("\\mathcal{L} &= " if first else "&\\quad+ ")
+                        in_block = True
+                        count = chars = 0
+                        self.blocks += 1
+                    f.write(fragment)
+                    first = False
+                    count += 1
+                    chars += len(fragment)
+                if in_block:
+                    f.write("\n\\end{align*}\n")
+
+            f.write("\\end{document}\n")
+        self._discard()
+
+
+def print_cancellation_summary(cancellation_summaries):
+    """Print the cancellation analyses of the children of direction-0 nodes."""
     print("\n" + "="*30)
     print("Cancellation Analysis Summary")
     print("="*30)
@@ -421,6 +524,93 @@ def functional_to_latex(A, Ba, U, root):
                 print(f"Analysis status: {analysis['status']}. Could not complete m computation or cancellation check.")
 
     print("\n" + "="*30 + "\n")
-    # --- End of summary printing ---
 
-    return latex_output
\ No newline at end of file
+
+def iter_latex_fragments(A, Ba, U, terms, m_values, cancellation_summaries):
+    """
+    Yield the LaTeX of each term as (level, fragment), in the order of the terms.
+
+    The cancellations of each direction-0 node are checked with its solved m (or the m of
+    compute_m_symbolic if there is none) when its first term goes by, and their summaries
+    are appended to cancellation_summaries.
+    """
+    analyses = {}  # Cancellation analysis of each direction-0 node, shared by its children
+
+    for term in terms:
+        node = term['node']
+        level = term['level']
+
+        if term['kind'] == 'base':
+            yield 0, term_to_latex(term, U)
+            continue
+
+        m_value = None
+        if term['kind'] != 'mixed':
+            parent = node.parent
+            if parent.direction == 0:
+                # Check for cancellations with the solved m (computed here if there is none)
+                if parent not in analyses:
+                    analyses[parent] = analyze_cancellations(parent.matrix, A, Ba, U, m_values.get(parent),
+                                                             parent.gram)
+                cancellation_summaries.append({
+                    'node': node.name,
+                    'node_info': f"Node at level {level}, name {node.name}",
+                    'analysis_result': analyses[parent]
+                })
+        else:
+            analysis = analyses.get(node.parent)
+            if m_values.get(node.parent) is None and analysis is not None and analysis['status'] == 'completed':
+                m_value = analysis['m_value']
+
+        fragment = term_to_latex(term, U, m_value)
+        if fragment is not None:
+            yield level, fragment
+
+
+def functional_to_latex(A, Ba, U, root, terms=None, m_values=None, cancellations=None, writer=None):
+    """
+    Convert the Lyapunov functional to LaTeX format with symbolic m computation.
+
+    Args:
+        A: Matrix A
+        Ba: Matrix Ba (antisymmetric part of B)
+        U: Vector U
+        root: Root of the explored tree
+        terms: Optional stream of functional terms (see iter_lyapunov_terms). If given,
+            the LaTeX is built while consuming it, so that printing or serialization
+            can share the same single pass over the tree.
+        m_values: The m of the direction-0 nodes (see solve_mixing_coefficients). They
+            are solved here if not given.
+        cancellations: Optional list, extended with the cancellation summaries
+            ({'node', 'node_info', 'analysis_result'}) of the children of direction-0 nodes
+        writer: Optional LatexWriter: the terms are streamed to its document instead of
+            being collected in a string
+
+    Returns:
+        The LaTeX string of the functional, or None if a writer is given
+    """
+    from tools.tree import iter_lyapunov_terms
+
+    if m_values is None:
+        m_values = solve_mixing_coefficients(root, A, Ba)
+    if terms is None:
+        terms = iter_lyapunov_terms(root, U, A, Ba, m_values)
+
+    cancellation_summaries = []  # List to store cancellation analysis results
+    fragments = iter_latex_fragments(A, Ba, U, terms, m_values, cancellation_summaries)
+
+    latex_output = None
+    if writer is not None:
+        for level, fragment in fragments:
+            writer.add(level, fragment)
+    else:
+        terms_by_level = {0: []}
+        for level, fragment in fragments:
+            terms_by_level.setdefault(level, []).append(fragment)
+        latex_output = latex_from_levels(terms_by_level)
+    print_cancellation_summary(cancellation_summaries)
+
+    if cancellations is not None:
+        cancellations.extend(cancellation_summaries)
+
+    return latex_output
@@ -0,0 +1,215 @@
+from sympy import QQ, fraction, together
+from sympy.polys.rings import ring
+from tools.cache import cached_product
+from tools.numeric import free_parameters
+from tools.specialize import nodes_by_level
+
+# Irreducible factors of the polynomials met so far, shared by every tree of the process
+_factors = {}
+_stats = {'factor_hits': 0, 'factor_misses': 0}
+
+
+def polynomial_factors(polynomial):
+    """
+    Irreducible factors of a polynomial of a ring QQ[params] that may vanish.
+
+    Constant factors, and factors that are nonzero by the assumptions of the symbols
+    (e.g. a parameter declared nonzero=True), are left out.
+
+    Returns:
+        tuple of factors, as polynomials of the same ring
+    """
+    factors = _factors.get(polynomial)
+    if factors is None:
+        _stats['factor_misses'] += 1
+        factors = tuple(factor for factor, _ in polynomial.factor_list()[1]
+                        if not factor.is_ground and not factor.as_expr().is_nonzero)
+        _factors[polynomial] = factors
+    else:
+        _stats['factor_hits'] += 1
+    return factors
+
+
+def factor_cache_info():
+    """Return the number of cached factorizations and the hits/misses so far."""
+    return dict(_stats, factors=len(_factors))
+
+
+def clear_factor_cache():
+    """Empty the factor cache."""
+    _factors.clear()
+    for key in _stats:
+        _stats[key] = 0
+
+
+class EchelonBasis:
+    """
+    Rows of a stack of matrices in fraction-free echelon form, extended incrementally.
+
+    The entries are polynomials of a ring QQ[params]. A new row is reduced against the
+    basis rows by cross-multiplication, v <- p v - v[c] b for a basis row b with pivot p
+    in column c, and divided by the gcd of its entries, so that no fraction appears. The
+    rank is that of the stack for generic parameters: it is the same at every point where
+    no pivot and no removed gcd vanishes. Their irreducible factors are collected in
+    self.factors, so the rank can only drop on the union of their zero sets.
+    """
+
+    def __init__(self, ring, cols, rows=(), factors=()):
+        self.ring = ring
+        self.cols = cols
+        self.rows = list(rows)  # (pivot column, row) in the order they were added
+        self.factors = set(factors)
+
+    @property
+    def rank(self):
+        return len(self.rows)
+
+    def copy(self):
+        # The rows are never modified in place, so the copies can share them
+        return EchelonBasis(self.ring, self.cols, self.rows, self.factors)
+
+    def ring_row(self, row):
+        """Row of SymPy entries as polynomials, clearing the denominators (whose factors are kept)."""
+        numerators, denominators = zip(*(fraction(together(entry)) for entry in row))
+        numerators = [self.ring.from_expr(entry) for entry in numerators]
+        denominators = [self.ring.from_expr(entry) for entry in denominators]
+        common = self.ring.one
+        for denominator in denominators:
+            if not denominator.is_ground:
+                self.factors.update(polynomial_factors(denominator))
+            common = common.lcm(denominator)
+        return [numerator * common.exquo(denominator) for numerator, denominator in zip(numerators, denominators)]
+
+    def add(self, matrix):
+        """
+        Add the rows of a SymPy matrix.
+
+        Returns:
+            The number of rows that were independent of the basis (the rank gained)
+        """
+        gained = 0
+        for i in range(matrix.rows):
+            row = self.ring_row(matrix.row(i))
+            for column, basis_row in self.rows:
+                if row[column]:
+                    pivot, entry = basis_row[column], row[column]
+                    row = [pivot * x - entry * y for x, y in zip(row, basis_row)]
+
+            nonzero = [j for j in range(self.cols) if row[j]]
+            if not nonzero:
+                continue
+
+            content = self.ring.zero
+            for j in nonzero:
+                content = content.gcd(row[j])
+            if not content.is_ground:
+                self.factors.update(polynomial_factors(content))
+                row = [x.exquo(content) for x in row]
+
+            # A constant pivot adds no condition: take the simplest entry
+            column = min(nonzero, key=lambda j: (not row[j].is_ground, len(row[j]), row[j].degree()))
+            if not row[column].is_ground:
+                self.factors.update(polynomial_factors(row[column]))
+            self.rows.append((column, row))
+            gained += 1
+        return gained
+
+
+def decision_locus(basis, X, A, Ba):
+    """
+    Replay check_rank_condition for a node X on the basis of M.
+
+    Returns:
+        (direction, factors): the generic direction, as check_rank_condition, and the
+        factors whose zero sets contain every parameter value where one of its ranks drops
+    """
+    with_A = basis.copy()
+    if with_A.add(cached_product(X, A)) > 0:
+        extended = with_A.copy()
+        direction = 0 if extended.add(cached_product(X, Ba)) > 0 else 1
+    else:
+        extended = basis.copy()
+        direction = -1 if extended.add(cached_product(X, Ba)) > 0 else None
+    # Both bases start from the factors of M
+    return direction, with_A.factors | extended.factors
+
+
+def rank_drop_locus(root, A, Ba, Bs, params=None):
+    """
+    Parameter values where the rank decisions of a symbolic tree may change.
+
+    The decisions of explore_tree are replayed level by level on an EchelonBasis of M,
+    extended with the children after each level, so that M is never eliminated again
+    from scratch. Each decision returns the factors of the pivots it used: away from
+    their zero sets, every rank of the decision, and so its direction, is the generic
+    one. The union over the tree is where the tree (and its functional) may not hold.
+
+    The locus is conservative: a factor marks where a pivot vanishes, which is necessary
+    but not sufficient for a rank to drop (see specialize_tree to check sample points).
+
+    Args:
+        root: Root of the tree returned by explore_tree
+        params: Parameter symbols. Defaults to the free symbols of A, Ba and Bs
+
+    Returns:
+        dict with:
+        - 'params': the parameters
+        - 'nodes': {node name: set of factors (SymPy expressions) of its decision}
+        - 'factors': the factors of the whole tree, sorted
+        - 'mismatch': names of the nodes whose replayed direction differs from the tree
+        - 'final_rank': the generic rank of all the nodes together
+    """
+    if params is None:
+        params = free_parameters(A, Ba, Bs)
+    params = list(params)
+    basis = EchelonBasis(ring(params, QQ)[0], Bs.cols)
+    basis.add(Bs)
+
+    node_factors = {}
+    mismatch = []
+    for level in nodes_by_level(root):
+        processed = [node for node in level if node.processed]
+        if not processed:
+            break
+
+        for node in processed:
+            direction, factors = decision_locus(basis, node.matrix, A, Ba)
+            node_factors[node.name] = factors
+            if direction != node.direction:
+                mismatch.append(node.name)
+
+        # Stack the children, as explore_tree does after each iteration
+        for node in processed:
+            for child in node.children:
+                basis.add(child.matrix)
+
+    factors = set(basis.factors)
+    for level_factors in node_factors.values():
+        factors |= level_factors
+
+    def to_expr(polynomials):
+        return sorted((factor.as_expr() for factor in polynomials), key=str)
+
+    return {
+        'params': params,
+        'nodes': {name: set(to_expr(polynomials)) for name, polynomials in node_factors.items()},
+        'factors': to_expr(factors),
+        'mismatch': mismatch,
+        'final_rank': basis.rank
+    }
+
+
+def print_rank_drop_locus(locus):
+    """Print where the tree may not hold, and the conditions of each decision."""
+    if not locus['params']:
+        return
+    if not locus['factors']:
+        print("Tree valid for all parameter values")
+    else:
+        conditions = ' or '.join(f"{factor} = 0" for factor in locus['factors'])
+        print(f"Tree valid except on: {conditions}")
+        for name, factors in locus['nodes'].items():
+            if factors:
+                print(f"  {name}: {', '.join(f'{factor} = 0' for factor in sorted(factors, key=str))}")
+    if locus['mismatch']:
+        print(f"Warning: replayed directions differ from the tree at {locus['mismatch']}")
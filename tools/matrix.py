@@ -1,11 +1,13 @@
+from sympy import Matrix, symbols
 from tools.create_system import Create_System
-from sympy import *
+from tools.cache import cached_product, cached_rank
+from tools.menu import ask_selection
 
 
 def compute_rank(matrix):
     """Compute the column rank of a symbolic matrix."""
     try:
-        rank = matrix.rank()
+        rank = cached_rank(matrix)
         print(f"Matrix dimensions: {matrix.rows} x {matrix.cols}")
         print(f"Computed column rank: {rank}")
         return rank
@@ -14,6 +16,27 @@ def compute_rank(matrix):
         return None
 
 
+def row_basis_factor(Bs):
+    """
+    Factor Bs = C R, with R the rows of a row basis of Bs (rank r x n).
+
+    Every node matrix Bs w(A, Ba) is then C R w(A, Ba). C has full column rank, so the
+    stacks of the blocks R w have the same ranks as those of the full matrices, and the
+    scalar products become ⟨C Y U, C Z U⟩ = ⟨G Y U, Z U⟩ with the r x r Gram matrix G = C^T C.
+
+    Returns:
+        (R, G), with G None when it is the identity (the rows of Bs outside the basis are zero)
+    """
+    from sympy import cancel, eye
+
+    _, pivots = Bs.T.rref()
+    R = Bs.extract(list(pivots), list(range(Bs.cols)))
+    C_T, _ = R.T.gauss_jordan_solve(Bs.T)
+    C = C_T.T.applyfunc(cancel)
+    G = (C.T * C).applyfunc(cancel)
+    return R, (None if G == eye(R.rows) else G)
+
+
 def print_matrix(matrix, title="Matrix"):
     """Print a matrix with aligned rows."""
     print(f"\n{title}:")
@@ -37,18 +60,18 @@ def check_rank_condition(M, X, r, A, Ba):
         -1: if rank([M; X*Ba]) > r
         None: if rank([M; X*Ba]) == r
     """
-    XA = X * A
+    XA = cached_product(X, A)
     M_XA = M.col_join(XA)
-    rank_M_XA = M_XA.rank()
+    rank_M_XA = cached_rank(M_XA)
 
     print(f"Rank of [M; X*A]: {rank_M_XA}")
 
     if rank_M_XA > r:
         print(f"Rank of [M; X*A] ({rank_M_XA}) > r ({r})")
 
-        XBa = X * Ba
+        XBa = cached_product(X, Ba)
         M_XA_XBa = M_XA.col_join(XBa)
-        rank_M_XA_XBa = M_XA_XBa.rank()
+        rank_M_XA_XBa = cached_rank(M_XA_XBa)
 
         print(f"Rank of [M; X*A; X*Ba]: {rank_M_XA_XBa}")
 
@@ -61,9 +84,9 @@ def check_rank_condition(M, X, r, A, Ba):
     else:
         print(f"Rank of [M; X*A] ({rank_M_XA}) == r ({r})")
 
-        XBa = X * Ba
+        XBa = cached_product(X, Ba)
         M_XBa = M.col_join(XBa)
-        rank_M_XBa = M_XBa.rank()
+        rank_M_XBa = cached_rank(M_XBa)
 
         print(f"Rank of [M; X*Ba]: {rank_M_XBa}")
 
@@ -161,65 +184,53 @@ def get_preset_matrices(preset_num):
     return presets.get(preset_num, None)
 
 
-def get_matrices():
-    """Get matrices from user input or presets."""
-    print("Choose an option:")
-    print("1. Input matrices manually")
-    print("2. Generate random matrices (HIGHLY UNSTABLE FOR NOW! Not recommended)")
-    print("3. Use preset matrices")
+def get_matrices(selection=None):
+    """
+    Get matrices from user input or presets.
+
+    Args:
+        selection: The answer to the menu (see ask_selection). The menu is shown if None
+    """
+    if selection is None:
+        selection = ask_selection()
+    if selection is None:
+        return None, None, None, None
 
-    choice = input("Enter your choice (1/2/3): ").strip()
+    choice = selection['choice']
 
     if choice == '1':
-        size = int(input("Enter the size of the matrices: "))
+        size = selection['size']
         splitter = Create_System(size)
         A, Ba, Bs = splitter.split_matrices()
         return A, Ba, Bs, size
 
     elif choice == '2':
-        size = int(input("Enter the size of the matrices: "))
+        size = selection['size']
         splitter = Create_System(size)
         A, Ba, Bs = splitter.generate_random_matrices()
         return A, Ba, Bs, size
 
-    elif choice == '3':
-        print("\nAvailable presets:")
-        print("1. 3x3 system with cancellation")
-        print("2. Timoshenko")
-        print("3. Timoshenko with Memory")
-        print("4. Timoshenko-Cattaneo")
-
-        preset_choice = input("Enter preset number (1-4): ").strip()
-
-        try:
-            preset_num = int(preset_choice)
-            preset_data = get_preset_matrices(preset_num)
-
-            if preset_data is None:
-                print("Invalid preset number. Exiting.")
-                return None, None, None, None
-
-            A_preset = preset_data['A']
-            B_preset = preset_data['B']
-            size = preset_data['size']
-            description = preset_data['description']
-            parameters = preset_data['parameters']
+    else:
+        preset_num = selection['preset']
+        preset_data = get_preset_matrices(preset_num)
 
-            # Calculate Ba and Bs
-            Bs = (B_preset + B_preset.T) / 2
-            Ba = (B_preset - B_preset.T) / 2
-            A = A_preset
+        if preset_data is None:
+            print("Invalid preset number. Exiting.")
+            return None, None, None, None
 
-            print(f"\nUsing preset {preset_num}: {description}")
-            print(f"Size: {size}x{size}")
-            print(f"Parameters: {parameters} (all nonzero)")
+        A_preset = preset_data['A']
+        B_preset = preset_data['B']
+        size = preset_data['size']
+        description = preset_data['description']
+        parameters = preset_data['parameters']
 
-            return A, Ba, Bs, size
+        # Calculate Ba and Bs
+        Bs = (B_preset + B_preset.T) / 2
+        Ba = (B_preset - B_preset.T) / 2
+        A = A_preset
 
-        except ValueError:
-            print("Invalid input. Please enter a number between 1 and 4.")
-            return None, None, None, None
+        print(f"\nUsing preset {preset_num}: {description}")
+        print(f"Size: {size}x{size}")
+        print(f"Parameters: {parameters} (all nonzero)")
 
-    else:
-        print("Invalid choice. Exiting.")
-        return None, None, None, None
\ No newline at end of file
+        return A, Ba, Bs, size
@@ -0,0 +1,46 @@
+# Interactive menu. This module must stay free of heavy imports (SymPy, NumPy), so that
+# the menu shows up immediately: the matrices are only built once the choice is made.
+
+PRESET_NAMES = {
+    1: "3x3 system with cancellation",
+    2: "Timoshenko",
+    3: "Timoshenko with Memory",
+    4: "Timoshenko-Cattaneo"
+}
+
+
+def ask_selection():
+    """
+    Show the menu and read how the matrices should be obtained.
+
+    Returns:
+        dict with 'choice' ('1', '2' or '3'), 'size' (options 1 and 2) and
+        'preset' (option 3), or None if the input is invalid
+    """
+    print("Choose an option:")
+    print("1. Input matrices manually")
+    print("2. Generate random matrices (HIGHLY UNSTABLE FOR NOW! Not recommended)")
+    print("3. Use preset matrices")
+
+    choice = input("Enter your choice (1/2/3): ").strip()
+
+    if choice in ('1', '2'):
+        size = int(input("Enter the size of the matrices: "))
+        return {'choice': choice, 'size': size}
+
+    elif choice == '3':
+        print("\nAvailable presets:")
+        for preset_num, name in PRESET_NAMES.items():
+            print(f"{preset_num}. {name}")
+
+        preset_choice = input(f"Enter preset number (1-{len(PRESET_NAMES)}): ").strip()
+
+        try:
+            return {'choice': choice, 'preset': int(preset_choice)}
+        except ValueError:
+            print(f"Invalid input. Please enter a number between 1 and {len(PRESET_NAMES)}.")
+            return None
+
+    else:
+        print("Invalid choice. Exiting.")
+        return None
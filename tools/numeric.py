@@ -0,0 +1,345 @@
+from sympy import lambdify
+from tools.backend import product
+
+
+def free_parameters(*matrices):
+    """Return the free symbols of the given matrices, sorted by name."""
+    symbols_found = set()
+    for matrix in matrices:
+        symbols_found |= matrix.free_symbols
+    return sorted(symbols_found, key=lambda s: s.name)
+
+
+def lambdify_matrix(matrix, params):
+    """
+    Compile a symbolic matrix into a NumPy function of the parameters.
+
+    Args:
+        matrix: SymPy matrix whose free symbols are among params
+        params: Sequence of SymPy symbols
+
+    Returns:
+        A function taking an array of parameter points of shape (P, len(params))
+        and returning an array of shape (P, rows, cols)
+    """
+    import numpy as np
+
+    params = list(params)
+    entries = lambdify(params, list(matrix), modules='numpy')
+
+    def evaluate(points):
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n_points = points.shape[0]
+        values = entries(*points.T) if params else entries()
+        # Constant entries come back as scalars: broadcast them over the points
+        result = np.empty((n_points, matrix.rows * matrix.cols), dtype=complex)
+        for k, value in enumerate(values):
+            result[:, k] = np.broadcast_to(value, (n_points,))
+        result = result.reshape(n_points, matrix.rows, matrix.cols)
+        if np.all(result.imag == 0):
+            return result.real
+        return result
+
+    return evaluate
+
+
+def parameter_points(params, samples=None):
+    """
+    Normalize parameter samples into an array of shape (P, len(params)).
+
+    Args:
+        params: Sequence of SymPy symbols
+        samples: Array of points, or dict {symbol: values}. May be None only if
+            there are no parameters.
+    """
+    import numpy as np
+
+    params = list(params)
+    if samples is None:
+        if params:
+            raise ValueError(f"Parameter samples are required for {params}")
+        return np.zeros((1, 0))
+    if isinstance(samples, dict):
+        missing = [p for p in params if p not in samples]
+        if missing:
+            raise ValueError(f"Missing samples for parameters {missing}")
+        columns = np.broadcast_arrays(*[np.atleast_1d(np.asarray(samples[p], dtype=float)) for p in params])
+        return np.stack(columns, axis=1)
+    points = np.atleast_2d(np.asarray(samples, dtype=float))
+    if points.shape[1] != len(params):
+        raise ValueError(f"Samples have {points.shape[1]} columns, expected {len(params)} for {params}")
+    return points
+
+
+def hermitian_part(K):
+    """Hermitian part (K + K^*)/2 of a stack of square matrices."""
+    import numpy as np
+    return (K + np.conj(np.swapaxes(K, -1, -2))) / 2
+
+
+def term_coefficient_matrix(term):
+    """
+    Coefficient matrix S of a functional term, so that the term equals
+    coefficient * ⟨left U, right (∂_x) U⟩ = U^T S (∂_x) U.
+    """
+    left, right = term['pair']
+    return term['coefficient'] * product(left.T, right)
+
+
+def is_parameter_free(*matrices):
+    """True if none of the matrices has free symbols."""
+    return not any(matrix.free_symbols for matrix in matrices)
+
+
+def to_float(matrix):
+    """Convert a parameter-free SymPy matrix into a float64 array."""
+    import numpy as np
+    return np.array(matrix.tolist(), dtype=float)
+
+
+def rank_increase(basis, block, rtol=1e-10):
+    """
+    Numeric rank gained by adding the rows of block to an orthonormal row basis.
+
+    The rows of block are projected on the orthogonal complement of the basis, and the
+    singular values of the residual are compared with the largest one of block.
+
+    Returns:
+        (gain, new_rows, kept, dropped): the rank gain, an orthonormal basis of the new
+        directions, and the smallest kept / largest dropped relative singular values
+    """
+    import numpy as np
+
+    residual = block - (block @ basis.T) @ basis
+    scale = np.linalg.norm(block, 2)
+    if scale == 0:
+        return 0, np.zeros((0, block.shape[1])), np.inf, 0.0
+
+    _, singular_values, Vt = np.linalg.svd(residual)
+    relative = singular_values / scale
+    gain = int(np.sum(relative > rtol))
+    kept = relative[gain - 1] if gain > 0 else np.inf
+    dropped = relative[gain] if gain < len(relative) else 0.0
+    return gain, Vt[:gain], kept, dropped
+
+
+def explore_tree_numeric(A, Ba, Bs, size, max_iterations=10, rtol=1e-10):
+    """
+    Explore the binary tree in float64 arithmetic, for parameter-free systems.
+
+    Same exploration as explore_tree, but M is kept as an orthonormal row basis and
+    every rank is an SVD-based numeric rank with relative tolerance rtol.
+
+    Args:
+        A, Ba, Bs: float64 arrays (see to_float)
+
+    Returns:
+        (root, final_rank, conditioning): the tree, with NumPy node matrices, the rank
+        reached, and the conditioning margin of the rank decisions, i.e. the smallest
+        relative singular value that was kept and the largest that was dropped
+    """
+    from tools.tree import TreeNode
+    import numpy as np
+
+    root = TreeNode(Bs, "Bs", level=0)
+    conditioning = {'smallest_kept': np.inf, 'largest_dropped': 0.0, 'rtol': rtol}
+
+    def gain(basis, block):
+        increase, new_rows, kept, dropped = rank_increase(basis, block, rtol)
+        conditioning['smallest_kept'] = min(conditioning['smallest_kept'], kept)
+        conditioning['largest_dropped'] = max(conditioning['largest_dropped'], dropped)
+        return increase, np.vstack([basis, new_rows])
+
+    current_rank, basis = gain(np.zeros((0, A.shape[1])), Bs)
+
+    print(f"\n{'=' * 60}")
+    print(f"BINARY TREE EXPLORATION (numeric, rtol={rtol})")
+    print(f"{'=' * 60}")
+    print(f"Initial rank: {current_rank}")
+    print(f"Target rank: {size}")
+
+    leaves = [root]
+    iteration = 0
+
+    while leaves and iteration < max_iterations and current_rank < size:
+        iteration += 1
+        new_leaves = []
+
+        for leaf in leaves:
+            XA = leaf.matrix @ A
+            XBa = leaf.matrix @ Ba
+
+            gain_A, basis_A = gain(basis, XA)
+            if gain_A > 0:
+                gain_Ba, _ = gain(basis_A, XBa)
+                result = 0 if gain_Ba > 0 else 1
+            else:
+                gain_Ba, _ = gain(basis, XBa)
+                result = -1 if gain_Ba > 0 else None
+
+            leaf.direction = result
+            print(f"Rank condition result for {leaf.name}: {result}")
+
+            if result in (1, 0):
+                child = TreeNode(XA, f"{leaf.name} A", parent=leaf)
+                leaf.add_child(child)
+                new_leaves.append(child)
+            if result in (-1, 0):
+                child = TreeNode(XBa, f"{leaf.name} Ba", parent=leaf)
+                leaf.add_child(child)
+                new_leaves.append(child)
+
+            leaf.processed = True
+
+        # Update M with the new leaves
+        for child in new_leaves:
+            increase, basis = gain(basis, child.matrix)
+            current_rank += increase
+        print(f"Iteration {iteration}: rank {current_rank}")
+
+        leaves = new_leaves
+
+    if current_rank >= size:
+        print(f"\nTarget rank {size} reached!")
+    elif iteration >= max_iterations:
+        print(f"\nMaximum iterations ({max_iterations}) reached. Stopping exploration.")
+
+    return root, current_rank, conditioning
+
+
+def exact_tree(root, A, Ba, Bs, recheck=False):
+    """
+    Rebuild a tree found by explore_tree_numeric with exact SymPy node matrices.
+
+    Args:
+        root: Root of the numeric tree
+        A, Ba, Bs: The exact SymPy matrices
+        recheck: If True, recompute every rank decision exactly with check_rank_condition
+
+    Returns:
+        (exact_root, mismatches): the exact tree, and the names of the nodes whose exact
+        direction differs from the numeric one (always empty if recheck is False)
+    """
+    from tools.tree import TreeNode
+    from tools.matrix import check_rank_condition
+    from tools.cache import cached_product, cached_rank
+
+    exact_root = TreeNode(Bs, "Bs", level=0)
+    mismatches = []
+    M = Bs
+    level = [(root, exact_root)]
+
+    while level:
+        next_level = []
+        if recheck:
+            r = cached_rank(M)
+        for node, exact in level:
+            exact.direction = node.direction
+            exact.processed = node.processed
+            if recheck and node.processed:
+                direction = check_rank_condition(M, exact.matrix, r, A, Ba)
+                if direction != node.direction:
+                    mismatches.append(node.name)
+
+            for child in node.children:
+                factor = A if child.name.endswith(" A") else Ba
+                exact_child = TreeNode(cached_product(exact.matrix, factor), child.name, parent=exact)
+                exact.add_child(exact_child)
+                next_level.append((child, exact_child))
+
+        for _, exact_child in next_level:
+            M = M.col_join(exact_child.matrix)
+        level = next_level
+
+    return exact_root, mismatches
+
+
+def numeric_mixing_coefficients(root, A, Ba, rtol=1e-10):
+    """
+    Float64 version of solve_mixing_coefficients, for a tree of explore_tree_numeric.
+
+    The equations ⟨XAU, XBaU⟩ = m ⟨XAU, XBaA²U⟩ of a node are solved for m in the
+    least-squares sense, and m is kept if the residual is below rtol relative to the
+    size of the two quadratic forms.
+
+    Returns:
+        dict {node: m}, with m None for the nodes where no constant m exists
+    """
+    from tools.tree import iter_nodes
+    import numpy as np
+
+    def symmetric(P, Q):
+        S = P.T @ Q
+        return (S + S.T) / 2
+
+    m_values = {}
+    for node in iter_nodes(root):
+        if node.direction != 0:
+            continue
+        XA = node.matrix @ A
+        XBa = node.matrix @ Ba
+        XBaAA = XBa @ A @ A
+        S_lhs = symmetric(XA, XBaAA)
+        S_rhs = symmetric(XA, XBa)
+        norm_lhs = np.linalg.norm(XA) * np.linalg.norm(XBaAA)
+        if np.linalg.norm(S_lhs) <= rtol * norm_lhs:
+            m_values[node] = None
+            continue
+        m = np.sum(S_lhs * S_rhs) / np.sum(S_lhs * S_lhs)
+        residual = np.linalg.norm(m * S_lhs - S_rhs)
+        m_values[node] = float(m) if residual <= rtol * (np.linalg.norm(XA) * np.linalg.norm(XBa)
+                                                         + abs(m) * norm_lhs) else None
+    return m_values
+
+
+def numeric_terms(root, A, Ba, m=1.0):
+    """
+    Yield the functional terms of a numeric tree with their float64 coefficient matrix.
+
+    Each term is the dict of iter_term_pairs, with the additional key
+        - 'matrix': S = coefficient * left^T right, so that the term is U^T S (∂_x) U
+
+    The nodes without a constant m keep m free, as in the symbolic functional: their
+    mixed terms get the coefficient None and the matrix of m, S = left^T right.
+
+    Args:
+        m: Coefficient of the mixed terms: one value for all direction-0 nodes, or a
+            dict {node: m} (see numeric_mixing_coefficients), with None for the nodes
+            where no constant m exists
+    """
+    from tools.tree import iter_term_pairs
+    import numpy as np
+
+    for term in iter_term_pairs(root, A, Ba, m, np.eye(A.shape[0])):
+        left, right = term['pair']
+        if term['kind'] == 'mixed' and isinstance(m, dict) and m.get(term['node'].parent) is None:
+            term['coefficient'] = None
+            term['matrix'] = left.T @ right
+        else:
+            term['matrix'] = float(term['coefficient']) * (left.T @ right)
+        yield term
+
+
+def print_numeric_terms(terms):
+    """Print each numeric functional term as it goes by (see print_lyapunov_terms), passing the terms through."""
+    import numpy as np
+
+    for term in terms:
+        if term['kind'] == 'base':
+            print("Initial term: (1/2)||U||^2")
+        else:
+            indent = "  " * term['level']
+            left, right = term['labels']
+            dx_label = " ∂_x" if term['derivative'] else ""
+            if term['coefficient'] is None:
+                coefficient = "m "
+            else:
+                coefficient = "" if term['coefficient'] == 1 else f"{float(term['coefficient']):.6g}"
+            S = term['matrix']
+            print(f"\n{indent}Processing node {term['node'].name}, node number {term['node'].number}, "
+                  f"Direction of parent {term['node'].parent.direction}")
+            if term['coefficient'] is None:
+                print(f"{indent}Warning: no constant m at {term['node'].parent.name}, m is left free in this term")
+            print(f"{indent}Added term: (1/ξ^{term['xi_exp']}) {coefficient}⟨{left} U, {right}{dx_label} U⟩")
+            print(f"{indent}Coefficient matrix: {S.shape[0]}x{S.shape[1]}, max |S_ij| = {np.abs(S).max():.6g}")
+        yield term
@@ -0,0 +1,135 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from sympy import Matrix, Rational, eye, symbols
+from tools.tree import explore_tree, iter_nodes, make_term, node_term_pairs, term_expression
+from tools.latex import (analyze_cancellations, compute_m_symbolic, latex_from_levels, solve_mixing_coefficients,
+                         term_to_latex)
+
+
+def portable_term(term):
+    """Copy of a term with the node replaced by its name, so that it can be sent to another process."""
+    return dict(term, node=term['node'].name)
+
+
+def term_task(term, U, m_node=None, X=None, A=None, Ba=None, gram=None):
+    """
+    Stage work for one term: its expression and LaTeX.
+
+    A mixed term whose node X has no solved m (m_node None) prints the m of
+    compute_m_symbolic instead, as functional_to_latex does.
+
+    Returns:
+        (term, expression, LaTeX or None)
+    """
+    latex_m = None
+    if term['kind'] == 'mixed' and m_node is None:
+        latex_m = compute_m_symbolic(X, A, Ba, U, gram)
+    expression = term_expression(term, U, symbols('dx'), symbols('xi'))
+    return term, expression, term_to_latex(term, U, latex_m)
+
+
+def run_pipeline(A, Ba, Bs, size, U=None, workers=None, executor=None, writer=None):
+    """
+    Explore the tree and build the functional, its LaTeX and the cancellation checks concurrently.
+
+    The terms of a node only depend on the node and on the direction of its parent, so as
+    soon as explore_tree finalizes a node, the expression and LaTeX of each term of its
+    children, and the cancellation check of a direction-0 node, are sent to a pool of
+    worker processes while the exploration goes on. The m of a direction-0 node is solved
+    right away, since its terms need it. When the exploration ends, only the last nodes are
+    still in progress, and the results are assembled in tree order.
+
+    Args:
+        U: Vector U (default: symbols u_1, ..., u_size)
+        workers: Number of worker processes, if no executor is given
+        executor: concurrent.futures executor to use instead of a new process pool
+        writer: Optional LatexWriter: the LaTeX terms are streamed to its document
+
+    Returns:
+        dict with:
+        - 'root', 'final_rank': the tree and the rank reached
+        - 'm_values': {node: m} of the direction-0 nodes
+        - 'terms': the terms of the functional in tree order, with their 'expression'
+        - 'latex': LaTeX code of the functional, as functional_to_latex (None with a writer)
+        - 'cancellations': the cancellation summaries, as functional_to_latex (see
+          print_cancellation_summary)
+        - 'timings': seconds spent in the exploration and in total
+    """
+    if U is None:
+        U = Matrix(symbols(' '.join([f'u_{i + 1}' for i in range(size)]), seq=True))
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    start = time.perf_counter()
+    m_values = {}
+    cancellation_futures = {}
+    term_futures = []  # in the order the nodes were finalized
+
+    def submit(parent):
+        if parent.direction is None or not parent.children:
+            return
+        m_node = None
+        if parent.direction == 0:
+            # Only the parent itself has a direction yet: this solves its m alone
+            m_node = solve_mixing_coefficients(parent, A, Ba)[parent]
+            m_values[parent] = m_node
+            cancellation_futures[parent] = executor.submit(analyze_cancellations, parent.matrix, A, Ba, U, m_node,
+                                                           parent.gram)
+
+        coefficient = symbols('m', real=True) if m_node is None else m_node
+        for child in parent.children:
+            for term in node_term_pairs(child, A, Ba, coefficient):
+                term_futures.append(executor.submit(term_task, portable_term(term), U,
+                                                    m_node, parent.matrix, A, Ba, parent.gram))
+
+    try:
+        root, final_rank = explore_tree(A, Ba, Bs, size, on_finalized=submit)
+        explored = time.perf_counter()
+
+        analyses = {parent: future.result() for parent, future in cancellation_futures.items()}
+        outputs = {}
+        for future in term_futures:
+            term, expression, fragment = future.result()
+            outputs.setdefault(term['node'], []).append((term, expression, fragment))
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    # Assemble in tree order, with the nodes back in the terms
+    identity = eye(size)
+    base = make_term(root, 'base', 0, identity, identity, ("U", "U"), False, Rational(1, 2))
+    base['expression'] = term_expression(base, U, symbols('dx'), symbols('xi'))
+    terms = [base]
+    terms_by_level = {0: [term_to_latex(base, U)]}
+    if writer is not None:
+        writer.add(0, terms_by_level[0][0])
+    cancellations = []
+    for node in iter_nodes(root):
+        for term, expression, fragment in outputs.get(node.name, []):
+            term = dict(term, node=node, expression=expression)
+            terms.append(term)
+            if fragment is not None:
+                if writer is not None:
+                    writer.add(term['level'], fragment)
+                else:
+                    terms_by_level.setdefault(term['level'], []).append(fragment)
+            if term['kind'] != 'mixed' and node.parent.direction == 0:
+                cancellations.append({
+                    'node': node.name,
+                    'node_info': f"Node at level {term['level']}, name {node.name}",
+                    'analysis_result': analyses[node.parent]
+                })
+
+    latex_output = latex_from_levels(terms_by_level) if writer is None else None
+
+    return {
+        'root': root,
+        'final_rank': final_rank,
+        'm_values': m_values,
+        'terms': terms,
+        'latex': latex_output,
+        'cancellations': cancellations,
+        'timings': {'exploration': explored - start, 'total': time.perf_counter() - start}
+    }
@@ -0,0 +1,280 @@
+import ast
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sympy import Float, Integer, Matrix, Rational, symbols
+from sympy.parsing.sympy_parser import convert_xor, parse_expr, standard_transformations
+from tools.matrix import get_preset_matrices
+from tools.analysis import analyze_system
+from tools.store import store_results
+
+
+# The parameters of the presets: the only names an entry of a request may use
+PARAMETERS = {str(p): p for p in symbols('a b c d k', real=True, nonzero=True)}
+
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow,
+                  ast.UAdd, ast.USub, ast.Constant, ast.Name, ast.Load)
+
+# Bounds keeping the evaluation of an entry cheap (it runs in the request handler)
+MAX_ENTRY_LENGTH = 200
+MAX_LITERAL = 10 ** 12
+MAX_EXPONENT = 16
+
+
+def small_exponent(node):
+    """True if an exponent is an integer literal (possibly negated) of at most MAX_EXPONENT."""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        node = node.operand
+    return isinstance(node, ast.Constant) and type(node.value) is int and node.value <= MAX_EXPONENT
+
+
+def is_power(node):
+    return isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow)
+
+
+def parse_entry(entry):
+    """
+    Parse a matrix entry of a request without evaluating arbitrary code.
+
+    An entry is a number, or a string made of numbers, the preset parameters
+    (a, b, c, d, k), + - * / ** ^ and parentheses. The string is checked against this
+    grammar before parse_expr sees it, and parse_expr only gets the parameters and the
+    SymPy number classes as names.
+
+    The size of the result is bounded as well: entries have at most MAX_ENTRY_LENGTH
+    characters, literals at most MAX_LITERAL in absolute value, and a power must have an
+    integer literal exponent of at most MAX_EXPONENT and no power in its base, so that
+    e.g. 9**9**9 is rejected instead of computed.
+    """
+    if isinstance(entry, bool) or not isinstance(entry, (int, float, str)):
+        raise ValueError(f"Invalid matrix entry {entry!r}: expected a number or a string")
+    if isinstance(entry, (int, float)):
+        if not abs(entry) <= MAX_LITERAL:
+            raise ValueError(f"Invalid matrix entry {entry!r}: numbers are limited to {MAX_LITERAL:g}")
+        return Integer(entry) if isinstance(entry, int) else Float(entry)
+    if len(entry) > MAX_ENTRY_LENGTH:
+        raise ValueError(f"Invalid matrix entry: longer than {MAX_ENTRY_LENGTH} characters")
+
+    try:
+        tree = ast.parse(entry.replace('^', '**'), mode='eval')
+    except SyntaxError:
+        raise ValueError(f"Invalid matrix entry {entry!r}")
+    for node in ast.walk(tree):
+        if (not isinstance(node, _ALLOWED_NODES)
+                or isinstance(node, ast.Constant) and type(node.value) not in (int, float)
+                or isinstance(node, ast.Name) and node.id not in PARAMETERS):
+            raise ValueError(f"Invalid matrix entry {entry!r}: only numbers, arithmetic and the parameters "
+                             f"{', '.join(PARAMETERS)} are allowed")
+        if isinstance(node, ast.Constant) and not abs(node.value) <= MAX_LITERAL:
+            raise ValueError(f"Invalid matrix entry {entry!r}: numbers are limited to {MAX_LITERAL:g}")
+        if is_power(node) and (not small_exponent(node.right)
+                               or any(is_power(inner) for inner in ast.walk(node.left))):
+            raise ValueError(f"Invalid matrix entry {entry!r}: powers need an integer exponent of at most "
+                             f"{MAX_EXPONENT} and no power in their base")
+
+    return parse_expr(entry, local_dict=dict(PARAMETERS),
+                      global_dict={'__builtins__': {}, 'Integer': Integer, 'Float': Float, 'Rational': Rational},
+                      transformations=standard_transformations + (convert_xor,))
+
+
+def system_from_payload(payload):
+    """
+    Build (A, Ba, Bs, size) from a job payload.
+
+    The payload is either {"preset": n} or {"A": rows, "B": rows}, where the entries
+    of the rows are numbers or expressions given as strings (see parse_entry).
+    """
+    if 'preset' in payload:
+        preset_data = get_preset_matrices(int(payload['preset']))
+        if preset_data is None:
+            raise ValueError(f"Unknown preset {payload['preset']}")
+        A, B = preset_data['A'], preset_data['B']
+    elif 'A' in payload and 'B' in payload:
+        A = Matrix([[parse_entry(entry) for entry in row] for row in payload['A']])
+        B = Matrix([[parse_entry(entry) for entry in row] for row in payload['B']])
+    else:
+        raise ValueError("The job must contain either 'preset' or both 'A' and 'B'")
+
+    if not A.is_square or A.shape != B.shape:
+        raise ValueError(f"A and B must be square matrices of the same size, got {A.shape} and {B.shape}")
+
+    Bs = (B + B.T) / 2
+    Ba = (B - B.T) / 2
+    return A, Ba, Bs, A.rows
+
+
+def job_payloads(payload):
+    """The system payloads of a job: the payload itself, or the list under 'batch'."""
+    if 'batch' in payload:
+        if not isinstance(payload['batch'], list) or not payload['batch']:
+            raise ValueError("'batch' must be a non-empty list of systems")
+        return payload['batch']
+    return [payload]
+
+
+def run_job(payload, db_path=None, job_id=None):
+    """
+    Worker entry point: analyze the systems described by a job payload.
+
+    With a database, the results are stored by the worker itself, all the systems of a
+    batch in a single transaction, and each result gets its 'run_id'. With a job id, the
+    results of a job are stored only once, however many times it runs (see add_results).
+
+    Returns:
+        The result of analyze_system, or the list of results for a batch
+    """
+    payloads = job_payloads(payload)
+    results = [analyze_system(*system_from_payload(system)) for system in payloads]
+
+    if db_path is not None:
+        run_ids = store_results(db_path, results, [system.get('preset') for system in payloads], job_id)
+        for result, run_id in zip(results, run_ids):
+            result['run_id'] = run_id
+
+    return results if 'batch' in payload else results[0]
+
+
+class JobManager:
+    """Bounded queue of analysis jobs, run by a pool of long-lived worker processes."""
+
+    def __init__(self, workers=2, queue_size=64, keep_results=1000, db_path=None):
+        # Worker processes stay alive between jobs, so SymPy and the caches stay warm
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.queue_size = queue_size
+        self.keep_results = keep_results
+        self.db_path = db_path
+        self.jobs = OrderedDict()
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, payload):
+        """Queue a job. Returns its id, or None if the queue is full."""
+        # Validate the payload now, so that malformed jobs are rejected immediately
+        for system in job_payloads(payload):
+            system_from_payload(system)
+
+        with self.lock:
+            if self.pending >= self.queue_size:
+                return None
+            self.pending += 1
+            job_id = uuid.uuid4().hex
+            future = self.executor.submit(run_job, payload, self.db_path, job_id)
+            self.jobs[job_id] = future
+            while len(self.jobs) > self.keep_results:
+                self.jobs.popitem(last=False)
+
+        future.add_done_callback(self._done)
+        return job_id
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def status(self, job_id):
+        """Return the status of a job (and its result once done), or None if unknown."""
+        with self.lock:
+            future = self.jobs.get(job_id)
+        if future is None:
+            return None
+
+        if not future.done():
+            return {'id': job_id, 'status': 'running' if future.running() else 'queued'}
+        error = future.exception()
+        if error is not None:
+            return {'id': job_id, 'status': 'failed', 'error': str(error)}
+        return {'id': job_id, 'status': 'done', 'result': future.result()}
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def make_handler(manager):
+    """Create the HTTP request handler bound to a job manager."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, {'status': 'ok', 'pending': manager.pending})
+            elif self.path == '/presets':
+                presets = []
+                preset_num = 1
+                while (preset_data := get_preset_matrices(preset_num)) is not None:
+                    presets.append({'preset': preset_num, 'description': preset_data['description'],
+                                    'size': preset_data['size'], 'parameters': preset_data['parameters']})
+                    preset_num += 1
+                self.send_json(200, presets)
+            elif self.path.startswith('/jobs/'):
+                job = manager.status(self.path[len('/jobs/'):])
+                if job is None:
+                    self.send_json(404, {'error': 'Unknown job'})
+                else:
+                    self.send_json(200, job)
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            # A browser cannot send a JSON body to another origin without a preflight
+            # request, which this server does not answer
+            if self.headers.get_content_type() != 'application/json':
+                self.send_json(415, {'error': 'Expected Content-Type: application/json'})
+                return
+
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                job_id = manager.submit(payload)
+            except Exception as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+            if job_id is None:
+                self.send_json(503, {'error': 'Job queue is full, retry later'})
+            else:
+                self.send_json(202, {'id': job_id, 'status': 'queued'})
+
+        def log_message(self, format, *args):
+            # Keep the console quiet, one line per request is too much for batch submissions
+            pass
+
+    return Handler
+
+
+def serve(host='127.0.0.1', port=8765, workers=2, queue_size=64, db_path=None):
+    """
+    Run the analysis server until interrupted.
+
+    Endpoints:
+        POST /jobs       submit {"preset": n}, {"A": rows, "B": rows} or {"batch": [systems]},
+                         returns the job id
+        GET  /jobs/<id>  status of a job, with tree, functional terms and LaTeX once done
+        GET  /presets    available presets
+        GET  /health     server status
+
+    With db_path, every result is also stored in that SQLite database (see ResultStore).
+    """
+    manager = JobManager(workers=workers, queue_size=queue_size, db_path=db_path)
+    server = ThreadingHTTPServer((host, port), make_handler(manager))
+    print(f"Serving on http://{host}:{port} with {workers} worker(s), queue size {queue_size}"
+          + (f", storing results in {db_path}" if db_path else ""))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
+        manager.shutdown()
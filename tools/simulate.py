@@ -0,0 +1,189 @@
+import os
+import tempfile
+import numpy as np
+from tools.numeric import free_parameters, lambdify_matrix, parameter_points
+from tools.kernels import compile_kernels
+
+
+def fourier_modes(n_points, length=2 * np.pi):
+    """Frequencies ξ of the discrete Fourier modes of a periodic grid, in numpy.fft order."""
+    return 2 * np.pi * np.fft.fftfreq(n_points, d=length / n_points)
+
+
+def batched_expm(M, order=16):
+    """
+    Matrix exponential of a stack of matrices, by scaling and squaring of a Taylor series.
+
+    Used for the modes where the eigendecomposition is ill-conditioned.
+    """
+    norm = np.abs(M).sum(axis=-1).max()
+    squarings = max(0, int(np.ceil(np.log2(norm))) + 1) if norm > 0 else 0
+    M = M / 2 ** squarings
+
+    result = np.broadcast_to(np.eye(M.shape[-1]), M.shape).astype(complex)
+    power = result.copy()
+    for k in range(1, order + 1):
+        power = power @ M / k
+        result = result + power
+    for _ in range(squarings):
+        result = result @ result
+    return result
+
+
+def simulate(A, B, u0, t_final, n_snapshots=50, values=None, length=2 * np.pi, path=None,
+             chunk_size=2 ** 16, cond_max=1e8):
+    """
+    Solve U_t + A U_x + B U = 0 on a periodic domain with an exact per-mode integrator.
+
+    Each Fourier mode evolves as û(t) = exp(-t (iξA + B)) û(0). The exponentials are
+    computed for all modes of a chunk at once from a batched eigendecomposition
+    E = V diag(w) V^-1, so that û(t) = V (e^(wt) ⊙ V^-1 û(0)) at every snapshot time.
+    Modes whose eigenvectors are ill-conditioned (nearly defective E) are propagated
+    with batched_expm instead.
+
+    The snapshots (Fourier coefficients) are streamed to a memory-mapped .npy file, so that
+    grids of millions of modes do not have to fit in memory.
+
+    Args:
+        A, B: Matrices of the system (SymPy)
+        u0: Initial data on the grid, array of shape (n_points, size)
+        t_final: Final time
+        n_snapshots: Number of snapshots, equally spaced in [0, t_final]
+        values: dict {parameter: value} for the parameters of A and B
+        length: Length of the periodic domain
+        path: File of the snapshots (default: a temporary file)
+        chunk_size: Number of modes processed together
+        cond_max: Largest condition number of V for which the eigendecomposition is used
+
+    Returns:
+        dict with:
+        - 'times': array (T,) of the snapshot times
+        - 'xi': array (N,) of the frequencies of the modes
+        - 'snapshots': memory-mapped array (T, N, size) of the Fourier coefficients
+        - 'path': file of the snapshots
+        - 'defective_modes': number of modes propagated with batched_expm
+        - 'length': length of the domain
+    """
+    params = free_parameters(A, B)
+    point = parameter_points(params, values)
+    A_num = lambdify_matrix(A, params)(point)[0]
+    B_num = lambdify_matrix(B, params)(point)[0]
+
+    u0 = np.asarray(u0)
+    n_points, size = u0.shape
+    if size != A_num.shape[0]:
+        raise ValueError(f"Initial data has {size} components, the system has {A_num.shape[0]}")
+
+    xi = fourier_modes(n_points, length)
+    times = np.linspace(0, t_final, n_snapshots)
+    dt = times[1] - times[0] if n_snapshots > 1 else 0.0
+    u0_hat = np.fft.fft(u0, axis=0)
+
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+    snapshots = np.lib.format.open_memmap(path, mode='w+', dtype=complex, shape=(n_snapshots, n_points, size))
+
+    defective_modes = 0
+    for start in range(0, n_points, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_points))
+        E = -(1j * xi[chunk, None, None] * A_num + B_num)
+        w, V = np.linalg.eig(E)
+        defective = np.linalg.cond(V) > cond_max
+        good = ~defective
+
+        # Well-conditioned modes: coordinates in the eigenbasis, evolved exactly
+        coordinates = np.linalg.solve(V[good], u0_hat[chunk][good][..., None])[..., 0]
+        good_index = np.arange(chunk.start, chunk.stop)[good]
+        for k, t in enumerate(times):
+            snapshots[k, good_index] = np.einsum('mij,mj->mi', V[good], np.exp(w[good] * t) * coordinates)
+
+        # Nearly defective modes: step with the exponential of one time step
+        if defective.any():
+            defective_modes += int(defective.sum())
+            propagator = batched_expm(E[defective] * dt)
+            bad_index = np.arange(chunk.start, chunk.stop)[defective]
+            u_hat = u0_hat[bad_index]
+            for k in range(n_snapshots):
+                snapshots[k, bad_index] = u_hat
+                u_hat = np.einsum('mij,mj->mi', propagator, u_hat)
+
+    snapshots.flush()
+
+    return {
+        'times': times,
+        'xi': xi,
+        'snapshots': snapshots,
+        'path': path,
+        'defective_modes': defective_modes,
+        'length': length
+    }
+
+
+def snapshot_to_physical(simulation, k):
+    """Solution on the grid at the k-th snapshot, array of shape (n_points, size)."""
+    return np.fft.ifft(simulation['snapshots'][k], axis=0).real
+
+
+def evaluate_functional(terms, A, B, simulation, values=None, weights=None, xi_min=1.0, chunk_size=2 ** 16):
+    """
+    Evaluate the Lyapunov functional on the snapshots of a simulation.
+
+    The terms are those summed by build_lyapunov (see iter_lyapunov_terms). By Parseval,
+    the functional is Σ_ξ û^* L(ξ) û over the modes, with L(ξ) the Hermitian matrix of the
+    functional in Fourier variables (from the compiled kernels of the functional), weighted
+    by level (e.g. the ε weights of compute_epsilon_weights). Being the high-frequency
+    functional, it is only summed over the modes with |ξ| >= xi_min. Its time derivative along solutions is -Σ_ξ û^* D(ξ) û,
+    with D = E^* L + L E and E = iξA + B, which is evaluated as well.
+
+    Returns:
+        dict with arrays of shape (T,):
+        - 'functional': value of the functional
+        - 'dissipation': Σ_ξ û^* D(ξ) û (the functional decays where it is positive)
+        - 'energy': |U|^2 over the same modes
+        and 'decreasing': True if the functional never increases between snapshots
+    """
+    kernels = compile_kernels(terms, A, B)
+    point = parameter_points(kernels.params, values)
+
+    snapshots = simulation['snapshots']
+    n_snapshots, n_points, _ = snapshots.shape
+    # Parseval normalization of numpy.fft on a grid of n_points over the domain
+    scale = simulation['length'] / n_points ** 2
+    modes = np.flatnonzero(np.abs(simulation['xi']) >= xi_min)
+
+    functional = np.zeros(n_snapshots)
+    dissipation = np.zeros(n_snapshots)
+    energy = np.zeros(n_snapshots)
+    for start in range(0, len(modes), chunk_size):
+        index = modes[start:start + chunk_size]
+        xi = simulation['xi'][index]
+
+        L = kernels.matrix('L', xi, point, weights)[0]
+        D = kernels.matrix('D', xi, point, weights)[0]
+
+        for k in range(n_snapshots):
+            u_hat = snapshots[k, index]
+            functional[k] += scale * np.einsum('mi,mij,mj->', np.conj(u_hat), L, u_hat).real
+            dissipation[k] += scale * np.einsum('mi,mij,mj->', np.conj(u_hat), D, u_hat).real
+            energy[k] += scale * np.sum(np.abs(u_hat) ** 2)
+
+    tolerance = 1e-12 * np.abs(functional).max(initial=0)
+    return {
+        'functional': functional,
+        'dissipation': dissipation,
+        'energy': energy,
+        'decreasing': bool(np.all(np.diff(functional) <= tolerance))
+    }
+
+
+def print_functional_decay(simulation, evaluation, max_rows=10):
+    """Print the functional, its dissipation and the energy at some of the snapshots."""
+    times = simulation['times']
+    step = max(1, len(times) // max_rows)
+    print(f"{'t':>10} {'functional':>14} {'dissipation':>14} {'energy':>14}")
+    for k in range(0, len(times), step):
+        print(f"{times[k]:10.4g} {evaluation['functional'][k]:14.6e} "
+              f"{evaluation['dissipation'][k]:14.6e} {evaluation['energy'][k]:14.6e}")
+    print(f"Functional {'decreasing' if evaluation['decreasing'] else 'NOT decreasing'} on the snapshots"
+          f" ({simulation['defective_modes']} nearly defective modes)")
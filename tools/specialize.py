@@ -0,0 +1,139 @@
+from tools.cache import cached_product
+from tools.numeric import free_parameters, lambdify_matrix, parameter_points
+
+
+def numeric_rank(stack, rtol=1e-10):
+    """
+    Numeric rank of a stack of matrices via SVD.
+
+    Args:
+        stack: Array of shape (P, rows, cols)
+        rtol: Singular values below rtol times the largest one count as zero
+
+    Returns:
+        Integer array of shape (P,)
+    """
+    import numpy as np
+
+    singular_values = np.linalg.svd(stack, compute_uv=False)
+    if singular_values.shape[-1] == 0:
+        return np.zeros(stack.shape[0], dtype=int)
+    largest = singular_values[..., :1]
+    return np.sum(singular_values > rtol * largest, axis=-1) * (largest[..., 0] > 0)
+
+
+def nodes_by_level(root):
+    """Group the nodes of the tree by level, in the order explore_tree created them."""
+    levels = [[root]]
+    while True:
+        children = [child for node in levels[-1] for child in node.children]
+        if not children:
+            return levels
+        levels.append(children)
+
+
+def specialize_tree(root, A, Ba, Bs, samples, params=None, rtol=1e-10):
+    """
+    Evaluate the rank decisions of a symbolic tree at many concrete parameter points.
+
+    The stacked matrices that explore_tree built at each iteration are compiled once and
+    evaluated at all points together. The decisions of check_rank_condition are then
+    recomputed at every point with numeric ranks, and compared with the generic
+    (symbolic) directions stored in the tree.
+
+    Args:
+        root: Root of the tree returned by explore_tree
+        A: Matrix A
+        Ba: Matrix Ba (antisymmetric part of B)
+        Bs: Matrix Bs (symmetric part of B)
+        samples: Parameter points, as an array of shape (P, len(params)) or a dict
+        params: Parameter symbols. Defaults to the free symbols of A, Ba and Bs
+        rtol: Relative tolerance of the numeric ranks
+
+    Returns:
+        dict with:
+        - 'params', 'points': the parameters and the points of shape (P, len(params))
+        - 'directions': {node name: array (P,) of directions, NaN where no children}
+        - 'mismatch': {node name: boolean array (P,), True where the direction differs}
+        - 'final_rank': array (P,) of the rank of all the nodes together
+        - 'valid': boolean array (P,), True where the generic tree is valid
+    """
+    import numpy as np
+
+    if params is None:
+        params = free_parameters(A, Ba, Bs)
+    params = list(params)
+    points = parameter_points(params, samples)
+    n_points = points.shape[0]
+
+    def evaluate(matrix):
+        return lambdify_matrix(matrix, params)(points)
+
+    def ranks(*blocks):
+        return numeric_rank(np.concatenate(blocks, axis=1), rtol)
+
+    directions = {}
+    mismatch = {}
+    valid = np.ones(n_points, dtype=bool)
+
+    M = evaluate(Bs)
+    for level in nodes_by_level(root):
+        processed = [node for node in level if node.processed]
+        if not processed:
+            break
+
+        r = ranks(M)
+        for node in processed:
+            XA = evaluate(cached_product(node.matrix, A))
+            XBa = evaluate(cached_product(node.matrix, Ba))
+
+            rank_M_XA = ranks(M, XA)
+            rank_M_XA_XBa = ranks(M, XA, XBa)
+            rank_M_XBa = ranks(M, XBa)
+
+            direction = np.where(rank_M_XA > r,
+                                 np.where(rank_M_XA_XBa > rank_M_XA, 0, 1),
+                                 np.where(rank_M_XBa > r, -1, np.nan))
+            if node.direction is None:
+                differs = ~np.isnan(direction)
+            else:
+                differs = direction != node.direction
+
+            directions[node.name] = direction
+            mismatch[node.name] = differs
+            valid &= ~differs
+
+        # Stack the children, as explore_tree does after each iteration
+        children = [child.matrix for node in processed for child in node.children]
+        if children:
+            M = np.concatenate([M] + [evaluate(child) for child in children], axis=1)
+
+    size = Bs.rows
+    final_rank = ranks(M)
+    valid &= final_rank >= size
+
+    return {
+        'params': params,
+        'points': points,
+        'directions': directions,
+        'mismatch': mismatch,
+        'final_rank': final_rank,
+        'valid': valid
+    }
+
+
+def print_specialization(result, max_points=10):
+    """Print a summary of the points where the generic tree is not valid."""
+    import numpy as np
+
+    params = ', '.join(str(p) for p in result['params'])
+    invalid = np.flatnonzero(~result['valid'])
+    print(f"Generic tree valid at {len(result['valid']) - len(invalid)} of {len(result['valid'])} points ({params})")
+
+    for index in invalid[:max_points]:
+        point = ', '.join(f"{value:.6g}" for value in result['points'][index])
+        changed = [name for name, differs in result['mismatch'].items() if differs[index]]
+        print(f"  ({point}): final rank {result['final_rank'][index]}, directions changed at {changed}")
+
+    if len(invalid) > max_points:
+        print(f"  ... and {len(invalid) - max_points} more")
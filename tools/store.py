@@ -0,0 +1,271 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    system_hash TEXT NOT NULL,
+    preset INTEGER,
+    size INTEGER NOT NULL,
+    parameters TEXT NOT NULL,
+    matrix_a TEXT NOT NULL,
+    matrix_b TEXT NOT NULL,
+    final_rank INTEGER,
+    complete INTEGER NOT NULL,
+    direction_pattern TEXT NOT NULL,
+    tree TEXT NOT NULL,
+    m_values TEXT NOT NULL,
+    latex TEXT NOT NULL,
+    exploration_time REAL,
+    functional_time REAL,
+    total_time REAL,
+    created REAL NOT NULL,
+    job_id TEXT,
+    job_index INTEGER
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    direction INTEGER,
+    number INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS terms (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    node TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    xi_exp INTEGER NOT NULL,
+    derivative INTEGER NOT NULL,
+    coefficient TEXT NOT NULL,
+    expression TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cancellations (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    node TEXT NOT NULL,
+    m_value TEXT,
+    status TEXT NOT NULL,
+    expression TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    solutions TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locus (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    factor TEXT NOT NULL
+);
+"""
+
+# Columns added after the first version of the schema, for the databases created before
+COLUMNS = [
+    ('runs', 'job_id', 'TEXT'),
+    ('runs', 'job_index', 'INTEGER'),
+]
+
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS runs_job ON runs(job_id, job_index);
+CREATE INDEX IF NOT EXISTS runs_system_hash ON runs(system_hash);
+CREATE INDEX IF NOT EXISTS runs_size ON runs(size);
+CREATE INDEX IF NOT EXISTS runs_preset ON runs(preset);
+CREATE INDEX IF NOT EXISTS runs_direction_pattern ON runs(direction_pattern);
+CREATE INDEX IF NOT EXISTS nodes_level_direction ON nodes(level, direction, run_id);
+CREATE INDEX IF NOT EXISTS nodes_run ON nodes(run_id);
+CREATE INDEX IF NOT EXISTS terms_run ON terms(run_id);
+CREATE INDEX IF NOT EXISTS cancellations_run ON cancellations(run_id);
+CREATE INDEX IF NOT EXISTS locus_run ON locus(run_id);
+"""
+
+# Symbols of the directions in a direction pattern
+DIRECTION_SYMBOLS = {1: '+', -1: '-', 0: '0', None: '.'}
+
+
+def system_hash(A_rows, B_rows):
+    """Hash of a system given as rows of strings (see matrix_to_rows)."""
+    return hashlib.sha256(json.dumps([A_rows, B_rows]).encode('utf-8')).hexdigest()
+
+
+def flatten_tree(tree):
+    """List the nodes of a tree dict (see tree_to_dict), level by level in creation order."""
+    nodes = []
+    level = [tree]
+    while level:
+        nodes.extend(level)
+        level = [child for node in level for child in node['children']]
+    return nodes
+
+
+def direction_pattern(tree):
+    """
+    Compact string of the directions of a tree dict, one group per level.
+
+    Directions are written '+' (1), '-' (-1), '0' (mixed) and '.' (no children), and the
+    levels are separated by '/'. For example '0/.+/.' is a mixed root whose Ba child goes right.
+    """
+    groups = {}
+    for node in flatten_tree(tree):
+        groups.setdefault(node['level'], []).append(DIRECTION_SYMBOLS[node['direction']])
+    return '/'.join(''.join(groups[level]) for level in sorted(groups))
+
+
+class ResultStore:
+    """SQLite database of analysis results (see analyze_system), safe to share between processes."""
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.row_factory = sqlite3.Row
+        # Write-ahead logging lets readers and one writer work at the same time
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        for table, column, column_type in COLUMNS:
+            existing = {row['name'] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self.connection.executescript(INDEXES)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_results(self, results, presets=None, job_id=None):
+        """
+        Insert many results in a single transaction.
+
+        With a job id, the k-th result is stored at most once as (job_id, k): a job that
+        runs twice (e.g. retried after its lease expired) keeps the runs of its first
+        completion, and the second insertion only returns their ids.
+
+        Args:
+            results: Iterable of dicts returned by analyze_system
+            presets: Optional iterable of the preset numbers of the results (None for custom systems)
+            job_id: Optional id of the job that produced the results
+
+        Returns:
+            The ids of the runs
+        """
+        results = list(results)
+        presets = [None] * len(results) if presets is None else list(presets)
+
+        run_ids = []
+        node_rows = []
+        term_rows = []
+        cancellation_rows = []
+        locus_rows = []
+        now = time.time()
+
+        with self.connection:
+            for index, (result, preset) in enumerate(zip(results, presets)):
+                system = result['system']
+                timings = result.get('timings', {})
+                job_index = None if job_id is None else index
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO runs (system_hash, preset, size, parameters, matrix_a, matrix_b,"
+                    " final_rank, complete, direction_pattern, tree, m_values, latex, exploration_time,"
+                    " functional_time, total_time, created, job_id, job_index)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (system_hash(system['A'], system['B']), preset, result['size'],
+                     json.dumps(system['parameters']), json.dumps(system['A']), json.dumps(system['B']),
+                     result['final_rank'], int(result['complete']), direction_pattern(result['tree']),
+                     json.dumps(result['tree']), json.dumps(result['m_values']), result['latex'],
+                     timings.get('exploration'), timings.get('functional'), timings.get('total'), now,
+                     job_id, job_index))
+                if cursor.rowcount == 0:
+                    # Already stored by an earlier run of the same job
+                    run_ids.append(self.connection.execute(
+                        "SELECT id FROM runs WHERE job_id = ? AND job_index = ?", (job_id, job_index)).fetchone()[0])
+                    continue
+                run_id = cursor.lastrowid
+                run_ids.append(run_id)
+
+                node_rows += [(run_id, node['name'], node['level'], node['direction'], node['number'])
+                              for node in flatten_tree(result['tree'])]
+                term_rows += [(run_id, term['node'], term['level'], term['kind'], term['xi_exp'],
+                               int(term['derivative']), term['coefficient'], term['expression'])
+                              for term in result['terms']]
+                cancellation_rows += [(run_id, c['node'], c['m_value'], c['status'], c['expression'],
+                                       c['parameters'], json.dumps(c['solutions']))
+                                      for c in result.get('cancellations', [])]
+                locus_rows += [(run_id, factor) for factor in result.get('locus', [])]
+
+            self.connection.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?)", node_rows)
+            self.connection.executemany("INSERT INTO terms VALUES (?, ?, ?, ?, ?, ?, ?, ?)", term_rows)
+            self.connection.executemany("INSERT INTO cancellations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        cancellation_rows)
+            self.connection.executemany("INSERT INTO locus VALUES (?, ?)", locus_rows)
+
+        return run_ids
+
+    def find_runs(self, size=None, preset=None, system=None, pattern=None, direction=None, level=None,
+                  complete=None, limit=None):
+        """
+        Query the runs through the indexed columns.
+
+        Args:
+            size, preset: Exact size / preset of the system
+            system: Hash of the system (see system_hash)
+            pattern: Direction pattern, exact or with SQL LIKE wildcards (e.g. '0/%')
+            direction, level: Keep the runs with a node of this direction (at this level, if given),
+                e.g. direction=0, level=2 for a mixed step at level 2
+            complete: Keep only the runs that did (True) or did not (False) reach full rank
+
+        Returns:
+            list of sqlite3.Row of the runs table
+        """
+        conditions = []
+        values = []
+        for column, value in (('size', size), ('preset', preset), ('system_hash', system)):
+            if value is not None:
+                conditions.append(f"runs.{column} = ?")
+                values.append(value)
+        if pattern is not None:
+            conditions.append("runs.direction_pattern LIKE ?" if '%' in pattern or '_' in pattern
+                              else "runs.direction_pattern = ?")
+            values.append(pattern)
+        if complete is not None:
+            conditions.append("runs.complete = ?")
+            values.append(int(complete))
+        if direction is not None or level is not None:
+            node_conditions = ["nodes.run_id = runs.id"]
+            for column, value in (('level', level), ('direction', direction)):
+                if value is not None:
+                    node_conditions.append(f"nodes.{column} = ?")
+                    values.append(value)
+            conditions.append(f"EXISTS (SELECT 1 FROM nodes WHERE {' AND '.join(node_conditions)})")
+
+        query = "SELECT * FROM runs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY runs.id"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return self.connection.execute(query, values).fetchall()
+
+    def terms(self, run_id):
+        """Functional terms of a run."""
+        return self.connection.execute("SELECT * FROM terms WHERE run_id = ?", (run_id,)).fetchall()
+
+    def cancellations(self, run_id):
+        """Cancellation checks of a run."""
+        return self.connection.execute("SELECT * FROM cancellations WHERE run_id = ?", (run_id,)).fetchall()
+
+    def locus(self, run_id):
+        """Factors whose zero sets contain the parameter values where the tree of a run may not hold."""
+        return [row['factor'] for row in
+                self.connection.execute("SELECT factor FROM locus WHERE run_id = ?", (run_id,)).fetchall()]
+
+    def count(self):
+        """Number of stored runs."""
+        return self.connection.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+
+def store_results(path, results, presets=None, job_id=None):
+    """Open the database at path, insert the results in one transaction and close it."""
+    with ResultStore(path) as store:
+        return store.add_results(results, presets, job_id)
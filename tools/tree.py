@@ -1,6 +1,10 @@
-from sympy import *
+import heapq
+import io
 from collections import deque
-from tools.latex import *
+from contextlib import redirect_stdout
+from sympy import Add, Rational, eye, symbols
+from tools.matrix import compute_rank, check_rank_condition, row_basis_factor
+from tools.cache import cached_product
 
 
 class TreeNode:
@@ -14,6 +18,8 @@ class TreeNode:
         self.children = []
         self.processed = False
         self.direction = None
+        # Gram matrix G of the factored root (see make_root), None if the matrices are full
+        self.gram = parent.gram if parent is not None else None
         self.discrepancy = self._calc_discrepancy()
         self.number = self._calc_number()
 
@@ -50,14 +56,43 @@ class TreeNode:
         child.level = self.level + 1
 
 
-def explore_tree(A, Ba, Bs, size, max_iterations=10):
-    """Explore the binary tree based on rank conditions."""
-    root = TreeNode(Bs, "Bs", level=0)
-    M = Bs.copy()
+def make_root(Bs, factored=True):
+    """
+    Root of the tree.
+
+    If factored, its matrix is a row basis R of Bs (see row_basis_factor) instead of Bs:
+    every node matrix is then an r x n block R w(A, Ba) instead of n x n, with r the rank
+    of Bs, for the same rank decisions. The Gram matrix G of the factorization is kept on
+    the nodes (node.gram), and weights the left side of the scalar products of the terms.
+    """
+    if not factored:
+        return TreeNode(Bs, "Bs", level=0)
+    R, G = row_basis_factor(Bs)
+    root = TreeNode(R, "Bs", level=0)
+    root.gram = G
+    return root
+
+
+def weighted(gram, P):
+    """Left matrix of a scalar product of factored nodes: G P, or P if the matrices are full."""
+    return P if gram is None else gram @ P
+
+
+def explore_tree(A, Ba, Bs, size, max_iterations=10, on_finalized=None, factored=True):
+    """
+    Explore the binary tree based on rank conditions.
+
+    Args:
+        on_finalized: Optional function called with each processed node as soon as its
+            direction and children are set, i.e. once the terms of its children are final
+        factored: Start from a row basis of Bs instead of Bs (see make_root)
+    """
+    root = make_root(Bs, factored)
+    M = root.matrix.copy()
     current_rank = compute_rank(M)
 
     print(f"\n{'=' * 60}")
-    print(f"BINARY TREE EXPLORATION")
+    print("BINARY TREE EXPLORATION")
     print(f"{'=' * 60}")
     print(f"Initial rank: {current_rank}")
     print(f"Target rank: {size}")
@@ -94,14 +129,14 @@ def explore_tree(A, Ba, Bs, size, max_iterations=10):
 
             # Add children based on result
             if result == 1:
-                child = TreeNode(leaf.matrix * A, f"{leaf.name} A", parent=leaf)
+                child = TreeNode(cached_product(leaf.matrix, A), f"{leaf.name} A", parent=leaf)
                 leaf.add_child(child)
                 new_leaves.append(child)
                 new_matrices.append(child.matrix)
                 print(f"Added child: {child.name}")
 
             elif result == -1:
-                child = TreeNode(leaf.matrix * Ba, f"{leaf.name} Ba", parent=leaf)
+                child = TreeNode(cached_product(leaf.matrix, Ba), f"{leaf.name} Ba", parent=leaf)
                 leaf.add_child(child)
                 new_leaves.append(child)
                 new_matrices.append(child.matrix)
@@ -109,8 +144,8 @@ def explore_tree(A, Ba, Bs, size, max_iterations=10):
 
             elif result == 0:
                 # Add both children
-                child_A = TreeNode(leaf.matrix * A, f"{leaf.name} A", parent=leaf)
-                child_Ba = TreeNode(leaf.matrix * Ba, f"{leaf.name} Ba", parent=leaf)
+                child_A = TreeNode(cached_product(leaf.matrix, A), f"{leaf.name} A", parent=leaf)
+                child_Ba = TreeNode(cached_product(leaf.matrix, Ba), f"{leaf.name} Ba", parent=leaf)
                 leaf.add_child(child_A)
                 leaf.add_child(child_Ba)
                 new_leaves.extend([child_A, child_Ba])
@@ -121,6 +156,8 @@ def explore_tree(A, Ba, Bs, size, max_iterations=10):
                 print(f"No children added for {leaf.name}")
 
             leaf.processed = True
+            if on_finalized is not None:
+                on_finalized(leaf)
 
         # Update M with new matrices
         if new_matrices:
@@ -144,86 +181,336 @@ def explore_tree(A, Ba, Bs, size, max_iterations=10):
     return root, current_rank
 
 
-def build_lyapunov(root, U, A, Ba, size, m=1, dx=None, xi=None):
-    """Build the Lyapunov functional based on tree exploration results."""
-    from sympy import symbols, Rational
+# Weights of the cost of a node for the best-first search: word length (tree level),
+# exponent of 1/ξ of its functional term, and number of operations in its matrix
+SEARCH_STRATEGIES = {
+    'best-first': {'word': 1, 'xi': 1, 'size': 0},
+    'shortest-word': {'word': 1, 'xi': 0, 'size': 0},
+    'smallest-expression': {'word': 1, 'xi': 0, 'size': 1}
+}
+
+
+def node_cost(node, weights):
+    """Cost of a node: weighted word length, xi exponent and expression size."""
+    cost = weights['word'] * node.level + weights['xi'] * 2 * (1 + node.number)
+    if weights['size']:
+        cost += weights['size'] * sum(entry.count_ops() for entry in node.matrix)
+    return cost
+
+
+def explore_tree_best_first(A, Ba, Bs, size, weights=None, max_expansions=50, factored=True):
+    """
+    Explore the tree best-first instead of level by level.
+
+    Unexpanded leaves wait in a priority queue, ordered by their cost (see node_cost)
+    divided by one plus the rank gained when their parent was expanded. A leaf is
+    expanded with check_rank_condition, as in explore_tree, but M is updated after every
+    expansion rather than after a whole level, so no leaf is judged against an outdated M.
+    The search stops as soon as the full rank is reached.
+
+    Args:
+        weights: Weights of node_cost (default: SEARCH_STRATEGIES['best-first'])
+        max_expansions: Maximum number of leaves to expand
+        factored: Start from a row basis of Bs instead of Bs (see make_root)
+
+    Returns:
+        (root, final_rank), as explore_tree
+    """
+    if weights is None:
+        weights = SEARCH_STRATEGIES['best-first']
+
+    root = make_root(Bs, factored)
+    M = root.matrix.copy()
+    current_rank = compute_rank(M)
+
+    print(f"\n{'=' * 60}")
+    print("BEST-FIRST TREE EXPLORATION")
+    print(f"{'=' * 60}")
+    print(f"Initial rank: {current_rank}")
+    print(f"Target rank: {size}")
+
+    # (score, insertion order, node): the insertion order breaks ties, first come first served
+    heap = [(0, 0, root)]
+    pushed = 1
+    expansions = 0
+
+    while heap and current_rank < size and expansions < max_expansions:
+        _, _, leaf = heapq.heappop(heap)
+        expansions += 1
+
+        print(f"\nProcessing leaf: {leaf.name}")
+        result = check_rank_condition(M, leaf.matrix, current_rank, A, Ba)
+        leaf.direction = result
+        leaf.processed = True
+        print(f"Rank condition result for {leaf.name}: {result}")
+
+        children = []
+        if result in (1, 0):
+            children.append(TreeNode(cached_product(leaf.matrix, A), f"{leaf.name} A", parent=leaf))
+        if result in (-1, 0):
+            children.append(TreeNode(cached_product(leaf.matrix, Ba), f"{leaf.name} Ba", parent=leaf))
+        if not children:
+            continue
+
+        for child in children:
+            leaf.add_child(child)
+            M = M.col_join(child.matrix)
+
+        new_rank = compute_rank(M)
+        gain = new_rank - current_rank
+        current_rank = new_rank
+        print(f"Added {', '.join(child.name for child in children)}. New rank: {current_rank}")
+
+        for child in children:
+            heapq.heappush(heap, (node_cost(child, weights) / (1 + gain), pushed, child))
+            pushed += 1
+
+    if current_rank >= size:
+        print(f"\nTarget rank {size} reached!")
+    elif expansions >= max_expansions:
+        print(f"\nMaximum expansions ({max_expansions}) reached. Stopping exploration.")
+
+    return root, current_rank
+
+
+def tree_size(root):
+    """Size of the functional of a tree: (number of nodes with a term, total xi exponent)."""
+    nodes = [node for node in iter_nodes(root) if node.parent is not None and node.parent.direction is not None]
+    return len(nodes), sum(2 * (1 + node.number) for node in nodes)
 
+
+def _run_strategy(A, Ba, Bs, size, strategy):
+    """Run one search strategy, capturing its output (used by explore_tree_smallest)."""
+    log = io.StringIO()
+    with redirect_stdout(log):
+        if strategy == 'breadth-first':
+            root, final_rank = explore_tree(A, Ba, Bs, size)
+        else:
+            root, final_rank = explore_tree_best_first(A, Ba, Bs, size, SEARCH_STRATEGIES[strategy])
+    return root, final_rank, log.getvalue()
+
+
+def explore_tree_smallest(A, Ba, Bs, size, strategies=None, parallel=False):
+    """
+    Run several search strategies and keep the smallest tree reaching the full rank.
+
+    Args:
+        strategies: Names among 'breadth-first' and SEARCH_STRATEGIES (default: all)
+        parallel: Run the strategies in separate processes
+
+    Returns:
+        (root, final_rank, strategy): the smallest valid tree (by tree_size), its rank and
+        the name of the strategy that found it. If no strategy reaches the full rank, the
+        tree with the highest rank is returned.
+    """
+    if strategies is None:
+        strategies = ['breadth-first'] + list(SEARCH_STRATEGIES)
+
+    if parallel:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=len(strategies)) as executor:
+            futures = [executor.submit(_run_strategy, A, Ba, Bs, size, strategy) for strategy in strategies]
+            results = [future.result() for future in futures]
+    else:
+        results = [_run_strategy(A, Ba, Bs, size, strategy) for strategy in strategies]
+
+    best = None
+    for strategy, (root, final_rank, _) in zip(strategies, results):
+        n_terms, xi_total = tree_size(root)
+        print(f"Strategy {strategy}: rank {final_rank}, {n_terms} terms, total xi exponent {xi_total}")
+        key = (-min(final_rank, size), n_terms, xi_total)
+        if best is None or key < best[0]:
+            best = (key, root, final_rank, strategy)
+
+    _, root, final_rank, strategy = best
+    print(f"Keeping the tree of strategy {strategy}")
+    return root, final_rank, strategy
+
+
+def iter_nodes(root):
+    """Yield the nodes of the tree in depth-first pre-order (the order of the functional)."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+
+
+def iter_term_pairs(root, A, Ba, m=1, identity=None):
+    """
+    Yield the bilinear pairs of the Lyapunov functional one at a time, in tree order.
+
+    Every term has the form coefficient * ⟨left U, right (∂_x) U⟩ / ξ^xi_exp and is
+    described by a dict with keys:
+        - 'node': the TreeNode producing the term (the root for the base term)
+        - 'level': level of the node in the tree
+        - 'kind': 'base', 'A', 'Ba' (direction ±1 and main mixed terms) or 'mixed' (m terms)
+        - 'xi_exp': exponent of 1/ξ
+        - 'pair': (left, right) matrices of the bilinear form
+        - 'labels': (left, right) names used when printing the pair
+        - 'derivative': True if ∂_x acts on the right vector
+        - 'coefficient': scalar coefficient of the scalar product
+
+    Products use @, so the node matrices may be SymPy or NumPy matrices.
+
+    Args:
+        m: Coefficient of the mixed terms: either one value for all direction-0 nodes,
+            or a dict {node: m} (see solve_mixing_coefficients), where the nodes without
+            a value get the symbol m
+        identity: Identity matrix of the base term (default: SymPy identity of A's size)
+    """
+    if identity is None:
+        identity = eye(A.shape[0])
+
+    # Base term: (1/2)||U||^2
+    yield make_term(root, 'base', 0, identity, identity, ("U", "U"), False, Rational(1, 2))
+
+    for node in iter_nodes(root):
+        parent = node.parent
+        if parent is None or parent.direction is None:
+            continue
+
+        if isinstance(m, dict):
+            m_node = m.get(parent)
+            m_node = symbols('m', real=True) if m_node is None else m_node
+        else:
+            m_node = m
+        yield from node_term_pairs(node, A, Ba, m_node)
+
+
+def make_term(node, kind, xi_exp, left, right, labels, derivative, coefficient):
+    """Dict of a functional term (see iter_term_pairs)."""
+    return {
+        'node': node,
+        'level': node.level,
+        'kind': kind,
+        'xi_exp': xi_exp,
+        'pair': (left, right),
+        'labels': labels,
+        'derivative': derivative,
+        'coefficient': coefficient
+    }
+
+
+def node_term_pairs(node, A, Ba, m=1):
+    """
+    Yield the terms of the functional produced by one node (see iter_term_pairs).
+
+    They only depend on the node and on the direction of its parent, so they are final
+    as soon as the parent is processed.
+
+    Args:
+        m: Coefficient of the mixed terms, if the parent has direction 0
+    """
+    parent = node.parent
+    xi_exp = 2 * (1 + node.number)
+    kind = 'A' if node.name.endswith('A') else 'Ba'
+    left = weighted(parent.gram, parent.matrix)
+
+    if parent.direction == 1:
+        # 1/ξ^(2*(1+node.number)) * ⟨parent*U, node*∂_x*U⟩
+        yield make_term(node, kind, xi_exp, left, node.matrix,
+                        (parent.name, node.name), True, 1)
+
+    elif parent.direction == -1:
+        # 1/ξ^(2*(1+node.number)) * ⟨parent*U, node*U⟩
+        yield make_term(node, kind, xi_exp, left, node.matrix,
+                        (parent.name, node.name), False, 1)
+
+    elif parent.direction == 0:
+        # Main term (∂_x only along A), followed by the mixed m term
+        yield make_term(node, kind, xi_exp, left, node.matrix,
+                        (parent.name, node.name), kind == 'A', 1)
+        yield make_term(node, 'mixed', xi_exp, weighted(parent.gram, parent.matrix @ A),
+                        parent.matrix @ Ba @ A,
+                        (f"{parent.name} A", f"{parent.name} Ba A"), False, m)
+
+
+def term_expression(term, U, dx, xi):
+    """SymPy expression of a functional term."""
+    left, right = term['pair']
+    right_U = right * dx * U if term['derivative'] else right * U
+    expression = term['coefficient'] * (right_U.T * (left * U))[0]
+    if term['xi_exp']:
+        expression = expression / (xi ** term['xi_exp'])
+    return expression
+
+
+def iter_lyapunov_terms(root, U, A, Ba, m=1, dx=None, xi=None):
+    """
+    Yield the terms of the Lyapunov functional one at a time, in tree order.
+
+    Each term is the dict of iter_term_pairs, with the additional key
+        - 'expression': the SymPy expression of the term
+
+    The full functional is never summed here; use functional_from_terms for that.
+    """
     if dx is None:
         dx = symbols('dx')
     if xi is None:
         xi = symbols('xi')
 
-    # Start with base term: (1/2)||U||^2
-    functional = Rational(1, 2) * U.T * U
-    functional = functional[0]
-
-    print(f"\nBuilding Lyapunov functional...")
-    print(f"Initial term: (1/2)||U||^2")
-
-    def add_terms(node, level=1):
-        nonlocal functional
-
-        if node.parent and node.parent.direction is not None:
-            indent = "  " * level
-            print(
-                f"\n{indent}Processing node {node.name}, node number {node.number}, Direction of parent {node.parent.direction}")
-
-            node_U = node.parent.matrix * U
-
-            if node.parent.direction == 1:
-                # Add 1/ξ^(2*(1+node.number)) * ⟨parent*U, node*∂_x*U⟩
-                node_dx_U = node.matrix * dx * U
-                term = (node_dx_U.T * node_U)[0] / (xi ** (2 * (1 + node.number)))
-                functional += term
-                print(f"{indent}Added term: (1/ξ^{2 * (1 + node.number)}) ⟨{node.parent.name} U, {node.name} ∂_x U⟩")
-                print(f"{indent}Term: {term}")
-
-            elif node.parent.direction == -1:
-                # Add 1/ξ^(2*(1+node.number)) * ⟨parent*U, node*U⟩
-                node_U_term = node.matrix * U
-                term = (node_U_term.T * node_U)[0] / (xi ** (2 * (1 + node.number)))
-                functional += term
-                print(f"{indent}Added term: (1/ξ^{2 * (1 + node.number)}) ⟨{node.parent.name} U, {node.name} U⟩")
-                print(f"{indent}Term: {term}")
-
-            elif node.parent.direction == 0:
-                if node.name.endswith('A'):
-                    # Mixed terms for A direction
-                    node_dx_U = node.matrix * dx * U
-                    node_A_U = node.parent.matrix * A * U
-                    node_Ba_A_U = node.parent.matrix * Ba * A * U
-
-                    term1 = (node_dx_U.T * node_U)[0]
-                    term2 = 2 * m * (node_Ba_A_U.T * node_A_U)[0]
-
-                    total_term = (term1 + term2) / (xi ** (2 * (1 + node.number)))
-                    functional += total_term
-                    print(
-                        f"{indent}Added mixed A terms: (1/ξ^{2 * (1 + node.number)}) [⟨{node.parent.name} U, {node.name} ∂_x U⟩ + m⟨{node.parent.name} A U, {node.parent.name} Ba A U⟩]")
-                    print(f"{indent}Term: {total_term}")
-
-                else:  # Ends with Ba
-                    # Mixed terms for Ba direction
-                    node_Ba_U = node.matrix * U
-                    node_A_U = node.parent.matrix * A * U
-                    node_Ba_A_U = node.parent.matrix * Ba * A * U
-
-                    term1 = (node_Ba_U.T * node_U)[0]
-                    term2 = 2 * m * (node_Ba_A_U.T * node_A_U)[0]
-
-                    total_term = (term1 + term2) / (xi ** (2 * (1 + node.number)))
-                    functional += total_term
-                    print(
-                        f"{indent}Added mixed Ba terms: (1/ξ^{2 * (1 + node.number)}) [⟨{node.parent.name} U, {node.name} U⟩ + m⟨{node.parent.name} A U, {node.parent.name} Ba A U⟩]")
-                    print(f"{indent}Term: {total_term}")
-
-        # Process children
-        for child in node.children:
-            add_terms(child, level + 1)
-
-    # Start from root's children
-    for child in root.children:
-        add_terms(child, level=0)
+    for term in iter_term_pairs(root, A, Ba, m, eye(U.rows)):
+        term['expression'] = term_expression(term, U, dx, xi)
+        yield term
+
+
+def print_lyapunov_terms(terms):
+    """Print each functional term as it goes by, passing the terms through unchanged."""
+    for term in terms:
+        if term['kind'] == 'base':
+            print("Initial term: (1/2)||U||^2")
+        else:
+            indent = "  " * term['level']
+            left, right = term['labels']
+            dx_label = " ∂_x" if term['derivative'] else ""
+            coefficient = "" if term['coefficient'] == 1 else f"{term['coefficient']}"
+            print(f"\n{indent}Processing node {term['node'].name}, node number {term['node'].number}, "
+                  f"Direction of parent {term['node'].parent.direction}")
+            print(f"{indent}Added term: (1/ξ^{term['xi_exp']}) {coefficient}⟨{left} U, {right}{dx_label} U⟩")
+            print(f"{indent}Term: {term['expression']}")
+        yield term
+
+
+def term_to_dict(term):
+    """Convert a functional term into a JSON-serializable dict."""
+    left, right = term['pair']
+    return {
+        'node': term['node'].name,
+        'level': term['level'],
+        'kind': term['kind'],
+        'xi_exp': term['xi_exp'],
+        'labels': list(term['labels']),
+        'pair': [[[str(entry) for entry in left.row(i)] for i in range(left.rows)],
+                 [[str(entry) for entry in right.row(i)] for i in range(right.rows)]],
+        'derivative': term['derivative'],
+        'coefficient': str(term['coefficient']),
+        'expression': str(term['expression'])
+    }
+
+
+def tree_to_dict(node):
+    """Convert a tree into nested JSON-serializable dicts."""
+    return {
+        'name': node.name,
+        'level': node.level,
+        'direction': node.direction,
+        'number': node.number,
+        'children': [tree_to_dict(child) for child in node.children]
+    }
+
+
+def functional_from_terms(terms):
+    """Sum a stream of functional terms into a single SymPy expression."""
+    return Add(*[term['expression'] for term in terms])
+
+
+def build_lyapunov(root, U, A, Ba, size, m=1, dx=None, xi=None):
+    """Build the Lyapunov functional based on tree exploration results."""
+    print("\nBuilding Lyapunov functional...")
+
+    terms = print_lyapunov_terms(iter_lyapunov_terms(root, U, A, Ba, m, dx, xi))
+    functional = functional_from_terms(terms)
 
     print(f"\nFinal Lyapunov functional (use this to check the LaTeX one):\n"
           f" {functional}")
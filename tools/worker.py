@@ -0,0 +1,268 @@
+"""
+Work queue on a shared filesystem, drained cooperatively by workers on several machines.
+
+The queue is a folder with one JSON file per job, moved between the subfolders
+pending/, leased/, done/ and failed/. A worker claims a job by renaming it from pending/
+to leased/: the rename is atomic, so exactly one worker gets it. While the job runs, the
+worker touches the leased file; a lease whose file was not touched for lease_seconds
+belongs to a crashed worker, and any worker moves the job back to pending/. A job is
+tried at most max_attempts times, then moved to failed/ with the last error.
+
+Usage, from the project folder:
+    python -m tools.worker submit QUEUE jobs.jsonl   (one job payload per line, as for the server)
+    python -m tools.worker status QUEUE
+    python main.py --worker QUEUE [--db results.db]
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+SUBFOLDERS = ('pending', 'leased', 'done', 'failed')
+
+
+def write_json(path, data):
+    """Write a JSON file atomically (temporary file + rename)."""
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class WorkQueue:
+    """Folder of lease files shared by the workers (see the module docstring)."""
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for subfolder in SUBFOLDERS:
+            os.makedirs(os.path.join(path, subfolder), exist_ok=True)
+
+    def job_path(self, state, job_id):
+        return os.path.join(self.path, state, f'{job_id}.json')
+
+    def job_ids(self, state):
+        """Ids of the jobs in a state, oldest first."""
+        names = [name for name in os.listdir(os.path.join(self.path, state)) if name.endswith('.json')]
+        return sorted(name[:-len('.json')] for name in names)
+
+    def submit(self, payloads):
+        """Add jobs to the queue. Returns their ids."""
+        job_ids = []
+        for payload in payloads:
+            # Time-ordered ids, so that workers take the oldest jobs first
+            job_id = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+            write_json(self.job_path('pending', job_id),
+                       {'id': job_id, 'payload': payload, 'attempts': 0, 'errors': []})
+            job_ids.append(job_id)
+        return job_ids
+
+    def claim(self, worker_id):
+        """
+        Take the oldest pending job.
+
+        Returns:
+            The job dict (with 'id', 'payload', 'attempts'), or None if no job is pending
+        """
+        for job_id in self.job_ids('pending'):
+            leased = self.job_path('leased', job_id)
+            try:
+                os.rename(self.job_path('pending', job_id), leased)
+            except FileNotFoundError:
+                # Another worker was faster
+                continue
+            # The rename keeps the submission time: start the lease now, or a job that
+            # waited longer than lease_seconds would look expired to the other workers
+            os.utime(leased)
+
+            job = read_json(leased)
+            job['attempts'] += 1
+            job['worker'] = worker_id
+            if job['attempts'] > self.max_attempts:
+                self._finish(job, 'failed')
+                continue
+            write_json(leased, job)
+            return job
+        return None
+
+    def heartbeat(self, job_id, worker_id):
+        """Renew the lease of a running job, if the worker still holds it."""
+        if not self.owns(job_id, worker_id):
+            return False
+        try:
+            os.utime(self.job_path('leased', job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def owns(self, job_id, worker_id):
+        """True if the lease of the job is still held by the worker."""
+        try:
+            return read_json(self.job_path('leased', job_id)).get('worker') == worker_id
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def complete(self, job, result):
+        """
+        Store the result of a job and release its lease, if its worker still holds it.
+
+        Returns:
+            False if the lease was lost (expired and taken by another worker): the job is
+            left to its new owner
+        """
+        if not self.owns(job['id'], job['worker']):
+            return False
+        job['result'] = result
+        self._finish(job, 'done')
+        return True
+
+    def release(self, job, error):
+        """Give a job back after an error: retried later, or failed after max_attempts."""
+        job['errors'].append(error)
+        leased = self.job_path('leased', job['id'])
+        if job['attempts'] >= self.max_attempts:
+            self._finish(job, 'failed')
+        else:
+            write_json(leased, job)
+            try:
+                os.rename(leased, self.job_path('pending', job['id']))
+            except FileNotFoundError:
+                pass
+
+    def _finish(self, job, state):
+        write_json(self.job_path(state, job['id']), job)
+        try:
+            os.remove(self.job_path('leased', job['id']))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self):
+        """
+        Move the jobs whose lease expired (crashed workers) back to pending.
+
+        Returns:
+            The number of jobs moved
+        """
+        now = time.time()
+        moved = 0
+        for job_id in self.job_ids('leased'):
+            leased = self.job_path('leased', job_id)
+            try:
+                expired = now - os.stat(leased).st_mtime > self.lease_seconds
+                if expired:
+                    os.rename(leased, self.job_path('pending', job_id))
+                    moved += 1
+            except FileNotFoundError:
+                continue
+        return moved
+
+    def status(self):
+        """Number of jobs in each state."""
+        return {state: len(self.job_ids(state)) for state in SUBFOLDERS}
+
+
+def run_worker(queue_path, worker_id=None, db_path=None, lease_seconds=600, max_attempts=3,
+               poll_interval=5.0, exit_when_empty=False):
+    """
+    Drain a work queue: claim jobs, run the pipeline on them and write the results back.
+
+    Each job payload is analyzed as a server job (see run_job), so it may hold a single
+    system or a batch. With db_path, the results are also stored in that SQLite database.
+
+    Args:
+        queue_path: Folder of the queue, on a filesystem shared by all workers
+        worker_id: Name of the worker in the lease files (default: host name and process id)
+        lease_seconds: Time without heartbeat after which a job is taken back from its worker
+        max_attempts: Number of tries of a job before it is moved to failed/
+        poll_interval: Seconds between two looks at an empty queue
+        exit_when_empty: Return when no job is pending or leased, instead of waiting for more
+
+    Returns:
+        The number of jobs completed by this worker
+    """
+    from tools.server import run_job
+
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+    print(f"Worker {worker_id} draining {queue_path}")
+
+    completed = 0
+    while True:
+        requeued = queue.requeue_expired()
+        if requeued:
+            print(f"Requeued {requeued} job(s) with an expired lease")
+
+        job = queue.claim(worker_id)
+        if job is None:
+            if exit_when_empty and not queue.job_ids('leased'):
+                break
+            time.sleep(poll_interval)
+            continue
+
+        # Renew the lease in the background while the pipeline runs
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(lease_seconds / 3):
+                queue.heartbeat(job['id'], worker_id)
+
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+        try:
+            result = run_job(job['payload'], db_path, job['id'])
+        except Exception:
+            stop.set()
+            error = traceback.format_exc()
+            print(f"Job {job['id']} failed (attempt {job['attempts']} of {max_attempts})")
+            if queue.owns(job['id'], worker_id):
+                queue.release(job, error)
+            continue
+        stop.set()
+
+        # If the lease expired meanwhile, the job belongs to another worker now. The
+        # database keeps the runs of a job id only once, whichever run stores them first
+        if not queue.complete(job, result):
+            print(f"Job {job['id']} finished after its lease was lost, left to its new owner")
+            continue
+        completed += 1
+        print(f"Job {job['id']} done")
+
+    print(f"Worker {worker_id} finished, {completed} job(s) completed")
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a work queue of analysis jobs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit = subparsers.add_parser('submit', help="add jobs from a file with one JSON payload per line")
+    submit.add_argument('queue')
+    submit.add_argument('jobs')
+
+    status = subparsers.add_parser('status', help="count the jobs in each state")
+    status.add_argument('queue')
+
+    args = parser.parse_args()
+    queue = WorkQueue(args.queue)
+    if args.command == 'submit':
+        with open(args.jobs, encoding='utf-8') as f:
+            payloads = [json.loads(line) for line in f if line.strip()]
+        print(f"Submitted {len(queue.submit(payloads))} job(s)")
+    else:
+        for state, count in queue.status().items():
+            print(f"{state:8s} {count}")
+
+
+if __name__ == "__main__":
+    main()